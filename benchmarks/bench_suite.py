@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""End to end benchmarks of submission, parsing and Excel output, written as JSON.
+
+    python benchmarks/bench_suite.py [--out bench.json] [--compare baseline.json]
+
+Three parts, each can be skipped with --skip:
+    submission - iprscan() against a local MockIPRScanServer at each
+                 --concurrency and --batch-records, reporting wall time,
+                 jobs and records per minute and HTTP requests per job.
+    parsing    - get_IPRScan_xml_data() over directories of --parse-sizes
+                 synthetic single protein XML files. The directories are
+                 kept in --work-dir and reused by later runs.
+    excel      - make_excel_sheet() writing --excel-rows rows.
+
+With --compare, timings are checked against an earlier JSON file and the
+script exits with status 1 if any got slower by more than --tolerance.
+benchmarks/baseline_submission.json is a submission run at the default
+settings with --batch-records 1,10, to compare against on like hardware.
+Use --quick for a fast smoke run.
+"""
+
+import os, sys, json, time, random, shutil, platform, argparse, tempfile, subprocess, contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from interproscantools.mock_server import MockIPRScanServer, synthetic_xml, AMINO_ACIDS
+from interproscantools.iprscan_from_fasta import iprscan
+from interproscantools.tabulate_iprs_results import get_IPRScan_xml_data, make_excel_sheet
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def int_list(s):
+    return [int(x) for x in s.split(',') if x]
+
+
+@contextlib.contextmanager
+def quiet():
+    # iprscan() and make_excel_sheet() are chatty
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            yield
+
+
+def random_seq(rng, length):
+    return ''.join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+def write_fasta(path, n_records, seq_len = 300, seed = 0):
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for i in range(n_records):
+            f.write('>protein_%d\n%s\n' % (i, random_seq(rng, seq_len)))
+
+
+def bench_submission(args, work_dir):
+    results = []
+    fasta = os.path.join(work_dir, 'submission.faa')
+    write_fasta(fasta, args.records)
+    for concurrency in args.concurrency:
+        for batch in args.batch_records:
+            out_dir = tempfile.mkdtemp(dir=work_dir)
+            with MockIPRScanServer(latency=args.latency, job_duration=args.job_duration,
+                                   duration_distribution='exponential', seed=concurrency) as server:
+                t = time.perf_counter()
+                with quiet():
+                    iprscan(fasta, out_dir, 'bench@example.com', max_concurrent_jobs=concurrency,
+                            polling_time=args.polling_time, results_formats=['xml'], base_url=server.url,
+                            batch_records=batch if batch > 1 else None)
+                secs = time.perf_counter() - t
+                requests = dict(server.request_counts)
+            n_results = len([f for f in os.listdir(out_dir) if f.endswith('.xml')])
+            shutil.rmtree(out_dir)
+            jobs = requests.get('run', 0)
+            # Keys of unbatched runs are the same as before batching was benchmarked
+            key = 'concurrency=%d' % concurrency + (' batch=%d' % batch if batch > 1 else '')
+            results.append({
+                'name': 'submission', 'key': key,
+                'concurrency': concurrency, 'batch_records': batch, 'records': args.records,
+                'results': n_results, 'seconds': secs, 'jobs_per_minute': jobs/secs*60,
+                'records_per_minute': n_results/secs*60,
+                'requests': requests, 'requests_per_job': sum(requests.values())/max(jobs, 1),
+            })
+            print('submission  concurrency %3d  batch %3d  %8.2f s  %8.1f records/min  %.2f requests/job' % (
+                concurrency, batch, secs, results[-1]['records_per_minute'], results[-1]['requests_per_job']))
+    return results
+
+
+def make_xml_dir(work_dir, n_files, matches):
+    """Directory of n_files single protein XML files, reused if it exists."""
+    dirname = os.path.join(work_dir, 'xml_%d_%d' % (n_files, matches))
+    done = os.path.join(dirname, '.complete')
+    if os.path.isfile(done):
+        return dirname
+    os.makedirs(dirname, exist_ok=True)
+    rng = random.Random(n_files)
+    width = len(str(n_files))
+    for i in range(n_files):
+        xml = synthetic_xml([(random_seq(rng, 300), 'protein_%d' % i)], matches)
+        with open(os.path.join(dirname, '%0*d.xml.xml' % (width, i)), 'w') as f:
+            f.write(xml)
+    open(done, 'w').close()
+    return dirname
+
+
+def bench_parsing(args, work_dir):
+    results = []
+    for n_files in args.parse_sizes:
+        dirname = make_xml_dir(work_dir, n_files, args.matches)
+        t = time.perf_counter()
+        deets = get_IPRScan_xml_data(dirname, args.processes)
+        secs = time.perf_counter() - t
+        assert len(deets) == n_files
+        results.append({
+            'name': 'parsing', 'key': 'files=%d,processes=%d' % (n_files, args.processes),
+            'files': n_files, 'matches_per_protein': args.matches, 'processes': args.processes,
+            'seconds': secs, 'files_per_second': n_files/secs,
+        })
+        print('parsing     %7d files  %8.2f s  %8.0f files/s' % (n_files, secs, n_files/secs))
+    return results
+
+
+def synthetic_deets(n_rows, rows_per_result = 10, seed = 0):
+    """deets dicts giving n_rows rows in make_excel_sheet."""
+    rng = random.Random(seed)
+    deets_set = []
+    for i in range(0, n_rows, rows_per_result):
+        n = min(rows_per_result, n_rows-i)
+        go = [rng.randrange(10**7) for _ in range(n)]
+        deets_set.append({
+            'filen': '%08d.xml.xml' % i,
+            'go num': {'GO:%07d' % g for g in go}, 'go term': {'go term %d' % g for g in go},
+            'dom': {'Entry %d description' % rng.randrange(5000)},
+            'fam': {'Entry %d description' % rng.randrange(5000)},
+            'seq': [random_seq(rng, 300)],
+        })
+    return deets_set
+
+
+def bench_excel(args, work_dir):
+    results = []
+    for n_rows in args.excel_rows:
+        deets_set = synthetic_deets(n_rows)
+        save_filename = os.path.join(work_dir, 'bench_%d.xlsx' % n_rows)
+        t = time.perf_counter()
+        with quiet():
+            make_excel_sheet(work_dir, save_filename, overwrite=True, deets_set=deets_set)
+        secs = time.perf_counter() - t
+        size = os.path.getsize(save_filename)
+        os.remove(save_filename)
+        results.append({
+            'name': 'excel', 'key': 'rows=%d' % n_rows, 'rows': n_rows,
+            'seconds': secs, 'rows_per_second': n_rows/secs, 'file_bytes': size,
+        })
+        print('excel       %7d rows   %8.2f s  %8.0f rows/s' % (n_rows, secs, n_rows/secs))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    """Print and count benchmarks more than tolerance slower than the baseline."""
+    with open(baseline_path) as f:
+        baseline = {(r['name'], r['key']): r['seconds'] for r in json.load(f)['results']}
+    regressions = 0
+    for r in results:
+        old = baseline.get((r['name'], r['key']))
+        if old is None:
+            continue
+        change = r['seconds']/old - 1
+        flag = ''
+        if change > tolerance:
+            regressions += 1
+            flag = '  REGRESSION'
+        print('%-11s %-28s %8.2f s -> %8.2f s  %+6.1f%%%s' % (
+            r['name'], r['key'], old, r['seconds'], change*100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', default='bench_results.json', help='JSON file to write.')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'iprscantools_bench'),
+                        help='Where synthetic inputs are kept between runs.')
+    parser.add_argument('--skip', default='', help='Comma separated parts to skip: submission,parsing,excel')
+    parser.add_argument('--quick', action='store_true', help='Small sizes, for checking the suite runs.')
+    parser.add_argument('--records', type=int, default=200, help='FASTA records submitted per concurrency level.')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 5, 10, 20])
+    parser.add_argument('--batch-records', type=int_list, default=[1],
+                        help='Records per submission to try at each concurrency, e.g. 1,10. Default 1.')
+    parser.add_argument('--job-duration', type=float, default=0.5, help='Mean mock job run time, seconds.')
+    parser.add_argument('--latency', type=float, default=0.005, help='Mock server latency, seconds.')
+    parser.add_argument('--polling-time', type=float, default=0.1, help='polling_time passed to iprscan().')
+    parser.add_argument('--parse-sizes', type=int_list, default=[1000, 10000, 100000])
+    parser.add_argument('--matches', type=int, default=5, help='Matches per protein in the parsing XML.')
+    parser.add_argument('-j', '--processes', type=int, default=1)
+    parser.add_argument('--excel-rows', type=int_list, default=[10000, 100000, 500000])
+    parser.add_argument('--compare', metavar='BASELINE_JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fractional slow down counted as a regression. Default 0.2')
+    args = parser.parse_args()
+    if args.quick:
+        args.records, args.concurrency = 20, [1, 10]
+        args.parse_sizes, args.excel_rows = [100], [2000]
+    skip = set(args.skip.split(','))
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = []
+    for name, bench in (('submission', bench_submission), ('parsing', bench_parsing),
+                        ('excel', bench_excel)):
+        if name not in skip:
+            results += bench(args, args.work_dir)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'work_dir')},
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('written', args.out)
+
+    if args.compare:
+        if compare(results, args.compare, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark IprHandler_v2 on a large multi-protein InterProScan XML file.
+
+Compares the current handler against the old one, which added every text
+node in the document onto self.seq, and against protein_record's
+ProteinRecordHandler, reporting parse time and peak memory (tracemalloc)
+for each, and the memory the result takes once parsing is done.
+
+    python benchmarks/bench_xml_parse.py [--proteins 2000] [--matches 20]
+
+The old handler only reset at <sequence> so it's worst on proteins with
+lots of matches, e.g. --proteins 1 --matches 4000.
+"""
+
+import os, sys, time, tempfile, tracemalloc, argparse, xml.sax
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from interproscantools.tabulate_iprs_results import IprHandler_v2
+from interproscantools.protein_record import ProteinRecordHandler
+from interproscantools.mock_server import write_synthetic_xml
+
+
+class LegacyIprHandler(xml.sax.ContentHandler):
+    # IprHandler_v2 as it was, for comparison
+    def __init__(self):
+        xml.sax.ContentHandler.__init__(self)
+        self.deets = {'go num':set(), 'go term':set(), 'dom':set(), 'fam':set(),
+                      'seq':''}
+        self.seq = ''
+    def startElement(self, name, attrs):
+        if name == 'sequence':
+            self.seq = ''
+        if name == 'entry':
+            if attrs['type'] == "DOMAIN":
+                self.deets['dom'].add(attrs['desc'])
+            if attrs['type'] == "FAMILY":
+                self.deets['fam'].add(attrs['desc'])
+        if name == 'go-xref':
+            self.deets['go term'].add(attrs['name'])
+            self.deets['go num'].add(attrs['id'])
+    def endElement(self, name):
+        if name == 'sequence':
+            self.deets['seq'] = [self.seq]
+            self.seq = ''
+    def characters(self, content):
+        self.seq += content
+
+
+def result_of(handler):
+    return handler.record if isinstance(handler, ProteinRecordHandler) else handler.deets
+
+
+def measure(handler_class, path, repeats = 3):
+    """Best wall time over repeats, peak traced memory of one parse and
+    memory still held by its result."""
+    times = []
+    for _ in range(repeats):
+        handler = handler_class()
+        t = time.perf_counter()
+        xml.sax.parse(path, handler)
+        times.append(time.perf_counter()-t)
+    tracemalloc.start()
+    handler = handler_class()
+    xml.sax.parse(path, handler)
+    result = result_of(handler)
+    del handler
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak, held, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--proteins', type=int, default=2000)
+    parser.add_argument('--matches', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.xml')
+        write_synthetic_xml(path, args.proteins, args.matches)
+        print('XML: %d proteins, %d matches each, %.1f MB' % (
+            args.proteins, args.matches, os.path.getsize(path)/1e6))
+        results = {}
+        for name, cls in (('before', LegacyIprHandler), ('after', IprHandler_v2),
+                          ('records', ProteinRecordHandler)):
+            secs, peak, held, result = measure(cls, path)
+            results[name] = result
+            print('%-7s %8.3f s  peak %8.1f MB  held %8.2f MB' % (name, secs, peak/1e6, held/1e6))
+        assert results['before'] == results['after'], 'handlers disagree'
+        assert results['records'].to_deets() == dict(results['after'], filen=None), 'record disagrees'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Stand-in for a local interproscan.sh, for trying out and timing LocalBackend.
+
+Takes the options LocalBackend uses (-i FASTA -f XML -o OUT.xml, -T, -appl,
+-goterms, -pa, -cpu, -dp) and writes made up InterProScan 5 XML for every
+record of the input, with the FASTA title as the protein's xref id.
+
+    python -m interproscantools.iprscan_from_fasta in.faa out/ me@example.com \\
+        --local benchmarks/interproscan_stub.py --batch-size 50 --local-processes 4
+
+Environment variables:
+    IPRSTUB_SECONDS_PER_SEQ - sleep this long per sequence (default 0)
+    IPRSTUB_FAIL_RATE - fraction of runs that exit with an error (default 0)
+    IPRSTUB_DROP - comma separated sequences left out of the output, as if
+                   InterProScan had skipped them
+"""
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from interproscantools.mock_server import synthetic_xml, parse_sequence_param
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-i', '--input', required=True)
+    parser.add_argument('-f', '--formats', default='XML')
+    parser.add_argument('-o', '--outfile', required=True)
+    parser.add_argument('-T', '--tempdir')
+    parser.add_argument('-appl', '--applications')
+    parser.add_argument('-goterms', '--goterms', action='store_true')
+    parser.add_argument('-pa', '--pathways', action='store_true')
+    parser.add_argument('-cpu', '--cpu', type=int)
+    parser.add_argument('-dp', '--disable-precalc', action='store_true')
+    args = parser.parse_args()
+
+    if args.formats.upper() != 'XML':
+        sys.exit('stub only writes XML')
+    if random.random() < float(os.environ.get('IPRSTUB_FAIL_RATE', 0)):
+        sys.exit('stub failure')
+    with open(args.input) as f:
+        proteins = parse_sequence_param(f.read())
+    time.sleep(float(os.environ.get('IPRSTUB_SECONDS_PER_SEQ', 0)) * len(proteins))
+    drop = set(os.environ.get('IPRSTUB_DROP', '').split(','))
+    proteins = [(seq, xref_id) for seq, xref_id in proteins if seq not in drop]
+    with open(args.outfile, 'w') as f:
+        f.write(synthetic_xml(proteins))
+    print('stub: %d sequences' % len(proteins))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,10 @@
 # Updated by JCThomas
 # * removed xmltramp2 (not 64bit compatible)
 # * some other fixes
+# * IPRScanClient class, importable without side effects, reusing
+#   keep-alive connections through a per host ConnectionPool
+# * optional token bucket rate limit shared by all requests of a client,
+#   GETs retried with jittered exponential backoff on 5xx/429/timeouts
 #
 # See:
 # http://www.ebi.ac.uk/Tools/webservices/services/pfa/iprscan5_rest
@@ -18,12 +22,22 @@
 baseUrl = 'http://www.ebi.ac.uk/Tools/services/rest/iprscan5'
 
 # Load libraries
-import platform, os, sys, time, re, urllib
+import platform, os, sys, time, re, io, threading, random, socket
+from concurrent.futures import ThreadPoolExecutor
+import urllib.parse
 from optparse import OptionParser
 #from xmltramp2 import xmltramp
-xmltramp = None
 import xml.etree.ElementTree as etree
 import urllib.request as urllib2
+import urllib.error
+import http.client
+try:
+    from .metrics import registry as metricsRegistry
+    from .file_utils import atomic_open
+except ImportError:
+    # Running as a script from within the package directory
+    from metrics import registry as metricsRegistry
+    from file_utils import atomic_open
 
 # Set interval for checking status
 checkInterval = 10
@@ -31,9 +45,23 @@ checkInterval = 10
 outputLevel = 1
 # Debug level
 debugLevel = 0
-# Number of option arguments.
-numOpts = len(sys.argv)
-
+# Seconds before a connection attempt or read gives up
+httpTimeout = 120
+# Maximum idle keep-alive connections kept per host
+maxPoolSize = 20
+# Bytes read at a time when saving results to disk
+downloadChunkSize = 64*1024
+# Result types of a job downloaded at once
+downloadWorkers = 4
+# Times a failed request is retried, GETs only apart from 429 responses
+maxRetries = 5
+# First retry waits up to this many seconds, doubling each time up to retryMaxDelay
+retryBackoff = 1.0
+retryMaxDelay = 60
+# Responses worth trying again
+retryStatusCodes = (429, 500, 502, 503, 504)
+# Requests per second allowed for each client, None for no limit
+requestsPerSecond = None
 # Usage message
 usage = "Usage: %prog [options...] [seqFile]"
 description = """Identify protein family, domain and signal signatures in a 
@@ -44,7 +72,7 @@ version = "$Id: iprscan5_urllib3.py 2773 2014-04-11 11:27:27Z hpm $"
 parser = OptionParser(usage=usage, description=description, epilog=epilog, version=version)
 # Tool specific options
 parser.add_option('--appl', help='signature methods to use, see --paramDetail appl')
-parser.add_option('--crc', action="store_true", help='enable InterProScan Matches look-up (ignored)')
+parser.add_option('--crc', action="store_true", help='enable InterProScan Matches look-up (ignored, see iprscan_from_fasta.py --precalc)')
 parser.add_option('--nocrc', action="store_true", help='disable InterProScan Matches look-up (ignored)')
 parser.add_option('--goterms', action="store_true", help='enable inclusion of GO terms')
 parser.add_option('--nogoterms', action="store_true", help='disable inclusion of GO terms')
@@ -55,8 +83,8 @@ parser.add_option('--sequence', help='input sequence file name')
 parser.add_option('--email', help='e-mail address')
 parser.add_option('--title', help='job title')
 parser.add_option('--outfile', help='file name for results')
-parser.add_option('--outformat', help='output format for results')
-parser.add_option('--async', action='store_true', help='asynchronous mode')
+parser.add_option('--outformat', help='output formats for results, comma separated')
+parser.add_option('--async', dest='async_mode', action='store_true', help='asynchronous mode')
 parser.add_option('--jobid', help='job identifier')
 parser.add_option('--polljob', action="store_true", help='get job result')
 parser.add_option('--status', action="store_true", help='get job status')
@@ -67,20 +95,8 @@ parser.add_option('--quiet', action='store_true', help='decrease output level')
 parser.add_option('--verbose', action='store_true', help='increase output level')
 parser.add_option('--baseURL', default=baseUrl, help='Base URL for service')
 parser.add_option('--debugLevel', type='int', default=debugLevel, help='debug output level')
-
-(options, args) = parser.parse_args()
-
-# Increase output level
-if options.verbose:
-    outputLevel += 1
-
-# Decrease output level
-if options.quiet:
-    outputLevel -= 1
-
-# Debug level
-if options.debugLevel:
-    debugLevel = options.debugLevel
+parser.add_option('--rateLimit', type='float', help='maximum requests per second')
+parser.add_option('--retries', type='int', default=maxRetries, help='times failed requests are retried')
 
 # Debug print
 def printDebugMessage(functionName, message, level):
@@ -106,226 +122,520 @@ def getUserAgent():
     printDebugMessage('getUserAgent', 'End', 11)
     return user_agent
 
+# Content types returned as bytes rather than decoded text
+binaryContentTypes = ("image/png;charset=UTF-8", "image/jpeg;charset=UTF-8",
+                      "application/gzip;charset=UTF-8")
+
+# Errors that mean a kept-alive connection was closed by the server while it
+# sat in the pool, the request can be sent again on a fresh connection.
+staleConnectionErrors = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                         ConnectionResetError, BrokenPipeError)
+
+# Errors that might not happen if the request is sent again
+transientErrors = (socket.timeout, TimeoutError, ConnectionError, http.client.HTTPException)
+
+# Token bucket limiting the rate of requests. One limiter can be shared by
+# several clients, acquire() blocks until a request is allowed.
+class RateLimiter(object):
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate limit must be above 0 requests per second, not %r' % rate)
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# A set of persistent connections to a single host. Connections are taken
+# from the pool for a single request/response and put back afterwards, so
+# thousands of status polls reuse the same TCP/TLS sessions.
+class ConnectionPool(object):
+    def __init__(self, scheme, host, timeout=None, maxsize=None):
+        self.scheme = scheme
+        self.host = host
+        self.timeout = httpTimeout if timeout is None else timeout
+        self.maxsize = maxPoolSize if maxsize is None else maxsize
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _newConnection(self):
+        printDebugMessage('ConnectionPool', 'new connection: ' + self.host, 12)
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._newConnection(), False
+
+    def _put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    # Send a request and return (status, reason, headers, body). If out is
+    # a file object a successful response body is copied into it in chunks
+    # and the returned body is None.
+    def request(self, method, path, body=None, headers=None, out=None):
+        headers = headers or {}
+        conn, reused = self._get()
+        try:
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+            except staleConnectionErrors:
+                if not reused:
+                    raise
+                # Server dropped the idle connection, try once more on a new one
+                conn.close()
+                conn = self._newConnection()
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+            if out is not None and resp.status == 200:
+                data = None
+                while True:
+                    chunk = resp.read(downloadChunkSize)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            else:
+                data = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put(conn)
+        return resp.status, resp.reason, resp.msg, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+# REST client for the InterProScan 5 service. A single client can be shared
+# between threads, it holds one ConnectionPool per host and builds the
+# User-agent string once. Requests are timed into metrics, a
+# metrics.Metrics, the shared metrics.registry by default.
+# rateLimit is requests per second or a RateLimiter to share with other
+# clients. GETs that fail with a 5xx/429 response, a timeout or a dropped
+# connection are retried up to maxRetries times with jittered exponential
+# backoff, a submission is only retried if it was refused with a 429.
+class IPRScanClient(object):
+    # Number of redirects followed before giving up
+    maxRedirects = 5
+
+    def __init__(self, baseUrl=None, timeout=None, maxPoolSize=None, metrics=None,
+                 rateLimit=None, maxRetries=None):
+        self.baseUrl = (globals()['baseUrl'] if baseUrl is None else baseUrl).rstrip('/')
+        self.metrics = metricsRegistry if metrics is None else metrics
+        if rateLimit is None:
+            rateLimit = requestsPerSecond
+        if rateLimit is not None and not isinstance(rateLimit, RateLimiter):
+            rateLimit = RateLimiter(rateLimit)
+        self.rateLimiter = rateLimit
+        self.maxRetries = globals()['maxRetries'] if maxRetries is None else maxRetries
+        self.timeout = timeout
+        self.maxPoolSize = maxPoolSize
+        self.userAgent = getUserAgent()
+        self._pools = {}
+        self._poolsLock = threading.Lock()
+        self._downloadPool = None
+
+    def _getPool(self, scheme, host):
+        key = (scheme, host)
+        with self._poolsLock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(scheme, host, self.timeout, self.maxPoolSize)
+                self._pools[key] = pool
+        return pool
+
+    def close(self):
+        with self._poolsLock:
+            pools, self._pools = list(self._pools.values()), {}
+            downloadPool, self._downloadPool = self._downloadPool, None
+        if downloadPool is not None:
+            downloadPool.shutdown()
+        for pool in pools:
+            pool.close()
+
+    def _getDownloadPool(self):
+        with self._poolsLock:
+            if self._downloadPool is None:
+                self._downloadPool = ThreadPoolExecutor(max_workers=downloadWorkers)
+            return self._downloadPool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Seconds to wait before retry number attempt (from 0), at least as
+    # long as the server asked for with Retry-After.
+    def _retryDelay(self, attempt, ex):
+        delay = min(retryMaxDelay, retryBackoff * 2**attempt) * random.uniform(0.5, 1.0)
+        if isinstance(ex, urllib.error.HTTPError):
+            try:
+                delay = max(delay, float(ex.headers.get('Retry-After')))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    # _requestOnce, retrying transient failures and waiting on the rate limiter
+    def _request(self, method, url, data=None, headers=None, out=None):
+        attempt = 0
+        while True:
+            if self.rateLimiter is not None:
+                self.rateLimiter.acquire()
+            try:
+                return self._requestOnce(method, url, data, headers, out)
+            except urllib.error.HTTPError as ex:
+                retry = ex.code in retryStatusCodes and (method == 'GET' or ex.code == 429)
+                if not retry or attempt >= self.maxRetries:
+                    raise
+                error = ex
+            except transientErrors as ex:
+                if method != 'GET' or attempt >= self.maxRetries:
+                    raise
+                error = ex
+            delay = self._retryDelay(attempt, error)
+            attempt += 1
+            printDebugMessage('_request', 'retry %d of %s in %.1fs after %r' % (attempt, url, delay, error), 1)
+            self.metrics.incr('iprscan.retries', error=repr(error))
+            if out is not None:
+                # Throw away anything written by the failed attempt
+                out.seek(0)
+                out.truncate()
+            time.sleep(delay)
+
+    # Make a HTTP request over a pooled connection, following redirects.
+    # Errors are raised as urllib.error.HTTPError like urllib.request does.
+    def _requestOnce(self, method, url, data=None, headers=None, out=None):
+        http_headers = {'User-Agent': self.userAgent}
+        if headers:
+            http_headers.update(headers)
+        for _ in range(self.maxRedirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            pool = self._getPool(parts.scheme, parts.netloc)
+            status, reason, resp_headers, body = pool.request(method, path, data, http_headers, out)
+            if status in (301, 302, 303, 307, 308) and resp_headers.get('Location'):
+                url = urllib.parse.urljoin(url, resp_headers['Location'])
+                printDebugMessage('_request', 'redirected to: ' + url, 11)
+                if status in (301, 302, 303) and method != 'GET':
+                    method, data = 'GET', None
+                    http_headers.pop('Content-Type', None)
+                continue
+            if status >= 400:
+                raise urllib.error.HTTPError(url, status, reason, resp_headers, io.BytesIO(body))
+            return resp_headers, body
+        raise urllib.error.HTTPError(url, status, 'Too many redirects', resp_headers, io.BytesIO(body))
+
+    # Wrapper for a REST (HTTP GET) request
+    def restRequest(self, url):
+        printDebugMessage('restRequest', 'Begin', 11)
+        printDebugMessage('restRequest', 'url: ' + url, 11)
+        # Errors are indicated by HTTP status codes.
+        try:
+            resp_headers, resp = self._request('GET', url)
+            contenttype = resp_headers.get("Content-Type")
+            if len(resp) > 0 and contenttype not in binaryContentTypes:
+                result = str(resp, 'utf-8')
+            else:
+                result = resp
+        except urllib.error.HTTPError as ex:
+            # Trap exception and output the document to get error message.
+            print (ex.read(), file=sys.stderr)
+            raise
+        printDebugMessage('restRequest', 'End', 11)
+        return result
+
+    # Get input parameters list
+    def serviceGetParameters(self):
+        printDebugMessage('serviceGetParameters', 'Begin', 1)
+        requestUrl = self.baseUrl + '/parameters'
+        printDebugMessage('serviceGetParameters', 'requestUrl: ' + requestUrl, 2)
+        xmlDoc = self.restRequest(requestUrl)
+        doc = etree.fromstring(xmlDoc)
+        printDebugMessage('serviceGetParameters', 'End', 1)
+        return [id_.text for id_ in doc.iter('id')]
+
+    # Get input parameter information
+    def serviceGetParameterDetails(self, paramName):
+        printDebugMessage('serviceGetParameterDetails', 'Begin', 1)
+        printDebugMessage('serviceGetParameterDetails', 'paramName: ' + paramName, 2)
+        requestUrl = self.baseUrl + '/parameterdetails/' + paramName
+        printDebugMessage('serviceGetParameterDetails', 'requestUrl: ' + requestUrl, 2)
+        xmlDoc = self.restRequest(requestUrl)
+        doc = etree.fromstring(xmlDoc)
+        printDebugMessage('serviceGetParameterDetails', 'End', 1)
+        return doc
+
+    # Submit job
+    def serviceRun(self, email, title, params):
+        printDebugMessage('serviceRun', 'Begin', 1)
+        # Don't modify the callers dict
+        params = dict(params)
+        # Insert e-mail and title into params
+        params['email'] = email
+        if title:
+            params['title'] = title
+        requestUrl = self.baseUrl + '/run/'
+        printDebugMessage('serviceRun', 'requestUrl: ' + requestUrl, 2)
+        # Signature methods requires special handling (list)
+        applData = ''
+        if 'appl' in params:
+            # So extract from params
+            applList = params['appl']
+            del params['appl']
+            # Build the method data options
+            for appl in applList:
+                applData += '&appl=' + appl
+        # Get the data for the other options
+        requestData = urllib.parse.urlencode(params)
+
+        requestData += applData
+        printDebugMessage('serviceRun', 'requestData: ' + requestData, 2)
+        # Errors are indicated by HTTP status codes.
+        try:
+            # Make the submission (HTTP POST).
+            with self.metrics.timer('iprscan.submit'):
+                resp_headers, resp = self._request(
+                    'POST', requestUrl, requestData.encode(encoding='utf_8', errors='strict'),
+                    {'Content-Type': 'application/x-www-form-urlencoded'}
+                )
+            jobId = str(resp, 'utf-8')
+        except urllib.error.HTTPError as ex:
+            # Trap exception and output the document to get error message.
+            print (ex.read(), file=sys.stderr)
+            raise
+        printDebugMessage('serviceRun', 'jobId: ' + jobId, 2)
+        printDebugMessage('serviceRun', 'End', 1)
+        return jobId
+
+    # Get job status
+    def serviceGetStatus(self, jobId):
+        printDebugMessage('serviceGetStatus', 'Begin', 1)
+        printDebugMessage('serviceGetStatus', 'jobId: ' + jobId, 2)
+        requestUrl = self.baseUrl + '/status/' + jobId
+        printDebugMessage('serviceGetStatus', 'requestUrl: ' + requestUrl, 2)
+        with self.metrics.timer('iprscan.status', job_id=jobId):
+            status = self.restRequest(requestUrl)
+        printDebugMessage('serviceGetStatus', 'status: ' + status, 2)
+        printDebugMessage('serviceGetStatus', 'End', 1)
+        return status
+
+    # Get available result types for job
+    def serviceGetResultTypes(self, jobId):
+        printDebugMessage('serviceGetResultTypes', 'Begin', 1)
+        printDebugMessage('serviceGetResultTypes', 'jobId: ' + jobId, 2)
+        requestUrl = self.baseUrl + '/resulttypes/' + jobId
+        printDebugMessage('serviceGetResultTypes', 'requestUrl: ' + requestUrl, 2)
+        with self.metrics.timer('iprscan.resulttypes', job_id=jobId):
+            xmlDoc = self.restRequest(requestUrl)
+        tree = etree.fromstring(xmlDoc)
+        printDebugMessage('serviceGetResultTypes', 'End', 1)
+        # Returns a list of elements with 'type' child elements
+        return tree.findall('type')
+
+    # Get result
+    def serviceGetResult(self, jobId, type_):
+        printDebugMessage('serviceGetResult', 'Begin', 1)
+        printDebugMessage('serviceGetResult', 'jobId: ' + jobId, 2)
+        printDebugMessage('serviceGetResult', 'type_: ' + type_, 2)
+        requestUrl = self.baseUrl + '/result/' + jobId + '/' + type_
+        with self.metrics.timer('iprscan.result', job_id=jobId, type=type_):
+            result = self.restRequest(requestUrl)
+        printDebugMessage('serviceGetResult', 'End', 1)
+        return result
+
+    # Client-side poll
+    def clientPoll(self, jobId, interval=None):
+        printDebugMessage('clientPoll', 'Begin', 1)
+        if interval is None:
+            interval = checkInterval
+        result = 'PENDING'
+        while result == 'RUNNING' or result == 'PENDING':
+            result = self.serviceGetStatus(jobId)
+            print (result, file=sys.stderr)
+            if result == 'RUNNING' or result == 'PENDING':
+                time.sleep(interval)
+        printDebugMessage('clientPoll', 'End', 1)
+
+    # Get result for a jobid
+    def getResult(self, jobId, outfile=None, outformat=None, interval=None):
+        printDebugMessage('getResult', 'Begin', 1)
+        printDebugMessage('getResult', 'jobId: ' + jobId, 1)
+        # Check status and wait if necessary
+        self.clientPoll(jobId, interval)
+        filenames = self.fetchResults(jobId, outfile, outformat)
+        printDebugMessage('getResult', 'End', 1)
+        return filenames
+
+    # Stream a result straight to a file, a partial download never shows
+    # up under filename
+    def downloadResult(self, jobId, type_, filename):
+        printDebugMessage('downloadResult', 'Begin', 1)
+        requestUrl = self.baseUrl + '/result/' + jobId + '/' + type_
+        printDebugMessage('downloadResult', 'requestUrl: ' + requestUrl, 2)
+        try:
+            with atomic_open(filename) as fh, self.metrics.timer('iprscan.result', job_id=jobId, type=type_):
+                self._request('GET', requestUrl, out=fh)
+        except urllib.error.HTTPError as ex:
+            print (ex.read(), file=sys.stderr)
+            raise
+        printDebugMessage('downloadResult', 'End', 1)
+        return filename
+
+    # Save the results of a finished job, returns the files written.
+    # outformat can be a single result type identifier or a list of them,
+    # all available types are saved if it's not given.
+    def fetchResults(self, jobId, outfile=None, outformat=None):
+        printDebugMessage('fetchResults', 'Begin', 1)
+        if isinstance(outformat, str):
+            outformat = re.split('[ \t\n,;]+', outformat)
+        # Get available result types
+        resultTypes = self.serviceGetResultTypes(jobId)
+        downloads = []
+        for resultType in resultTypes:
+            # Derive the filename for the result
+            suffix = resultType.find('fileSuffix').text
+            identifier = resultType.find('identifier').text
+            if outfile:
+                filename = outfile + '.' + identifier + '.' +suffix
+            else:
+                filename = jobId + '.' + identifier + '.' + suffix
+            if not outformat or identifier in outformat:
+                downloads.append((identifier, filename))
+        # Download the types in parallel
+        if len(downloads) > 1:
+            pool = self._getDownloadPool()
+            futures = [pool.submit(self.downloadResult, jobId, identifier, filename)
+                       for identifier, filename in downloads]
+            filenames = [f.result() for f in futures]
+        else:
+            filenames = [self.downloadResult(jobId, identifier, filename)
+                         for identifier, filename in downloads]
+        for filename in filenames:
+            print (filename)
+        printDebugMessage('fetchResults', 'End', 1)
+        return filenames
+
+
+# The module level functions below use a shared client for the current baseUrl
+defaultClient = None
+defaultClientLock = threading.Lock()
+
+def getDefaultClient():
+    global defaultClient
+    with defaultClientLock:
+        if defaultClient is None or defaultClient.baseUrl != baseUrl.rstrip('/'):
+            defaultClient = IPRScanClient(baseUrl)
+        return defaultClient
+
 # Wrapper for a REST (HTTP GET) request
 def restRequest(url):
-    printDebugMessage('restRequest', 'Begin', 11)
-    printDebugMessage('restRequest', 'url: ' + url, 11)
-    # Errors are indicated by HTTP status codes.
-    try:
-        # Set the User-agent.
-        user_agent = getUserAgent()
-        http_headers = { 'User-Agent' : user_agent }
-        req = urllib2.Request(url, None, http_headers)
-        # Make the request (HTTP GET).
-        reqH = urllib2.urlopen(req)
-        resp = reqH.read()
-        contenttype = reqH.getheader("Content-Type")
-                
-        if(len(resp)>0 and contenttype!="image/png;charset=UTF-8"
-            and contenttype!="image/jpeg;charset=UTF-8"
-            and contenttype!="application/gzip;charset=UTF-8"):
-            result = str(resp, 'utf-8')
-        else:
-            result = resp
-        reqH.close()
-    # Errors are indicated by HTTP status codes.
-    except urllib2.HTTPError as ex:
-        # Trap exception and output the document to get error message.
-        print (ex.read(), file=sys.stderr)
-        raise
-    printDebugMessage('restRequest', 'End', 11)
-    return result
+    return getDefaultClient().restRequest(url)
 
 # Get input parameters list
 def serviceGetParameters():
-    printDebugMessage('serviceGetParameters', 'Begin', 1)
-    requestUrl = baseUrl + '/parameters'
-    printDebugMessage('serviceGetParameters', 'requestUrl: ' + requestUrl, 2)
-    xmlDoc = restRequest(requestUrl)
-    print(xmlDoc)
-    doc = xmltramp.parse(xmlDoc)
-    printDebugMessage('serviceGetParameters', 'End', 1)
-    return doc['id':]
+    return getDefaultClient().serviceGetParameters()
 
 # Print list of parameters
-def printGetParameters():
+def printGetParameters(client=None):
     printDebugMessage('printGetParameters', 'Begin', 1)
-    idList = serviceGetParameters()
+    client = client or getDefaultClient()
+    idList = client.serviceGetParameters()
     for id_ in idList:
         print (id_)
-    printDebugMessage('printGetParameters', 'End', 1)    
+    printDebugMessage('printGetParameters', 'End', 1)
 
 # Get input parameter information
 def serviceGetParameterDetails(paramName):
-    printDebugMessage('serviceGetParameterDetails', 'Begin', 1)
-    printDebugMessage('serviceGetParameterDetails', 'paramName: ' + paramName, 2)
-    requestUrl = baseUrl + '/parameterdetails/' + paramName
-    printDebugMessage('serviceGetParameterDetails', 'requestUrl: ' + requestUrl, 2)
-    xmlDoc = restRequest(requestUrl)
-    print(xmlDoc)
-    doc = xmltramp.parse(xmlDoc)
-    printDebugMessage('serviceGetParameterDetails', 'End', 1)
-    return doc
+    return getDefaultClient().serviceGetParameterDetails(paramName)
 
 # Print description of a parameter
-def printGetParameterDetails(paramName):
+def printGetParameterDetails(paramName, client=None):
     printDebugMessage('printGetParameterDetails', 'Begin', 1)
-    doc = serviceGetParameterDetails(paramName)
-    print (str(doc.name) + "\t" + str(doc.type))
-    print (doc.description)
-    for value in doc.values:
-        print (value.value,end=" ")
-        if str(value.defaultValue) == 'true':
+    client = client or getDefaultClient()
+    doc = client.serviceGetParameterDetails(paramName)
+    print (str(doc.findtext('name')) + "\t" + str(doc.findtext('type')))
+    print (doc.findtext('description'))
+    for value in doc.iter('value'):
+        print (value.findtext('value'), end=" ")
+        if value.findtext('defaultValue') == 'true':
             print ('default', end=" ")
         print('\n')
-        print ("\t" + str(value.label))
-        if(hasattr(value, 'properties')):
-            for wsProperty in value.properties:
-                print  ("\t" + str(wsProperty.key) + "\t" + str(wsProperty.value))
-    #print doc
+        print ("\t" + str(value.findtext('label')))
+        for wsProperty in value.iter('property'):
+            print  ("\t" + str(wsProperty.findtext('key')) + "\t" + str(wsProperty.findtext('value')))
     printDebugMessage('printGetParameterDetails', 'End', 1)
 
 # Submit job
 def serviceRun(email, title, params):
-    printDebugMessage('serviceRun', 'Begin', 1)
-    # Insert e-mail and title into params
-    params['email'] = email
-    if title:
-        params['title'] = title
-    requestUrl = baseUrl + '/run/'
-    printDebugMessage('serviceRun', 'requestUrl: ' + requestUrl, 2)
-    # Signature methods requires special handling (list)
-    applData = ''
-    if 'appl' in params:
-        # So extract from params
-        applList = params['appl']
-        del params['appl']
-        # Build the method data options
-        for appl in applList:
-            applData += '&appl=' + appl
-    # Get the data for the other options
-    requestData = urllib.parse.urlencode(params)
-    
-    requestData += applData
-    printDebugMessage('serviceRun', 'requestData: ' + requestData, 2)
-    # Errors are indicated by HTTP status codes.
-    try:
-        # Set the HTTP User-agent.
-        user_agent = getUserAgent()
-        http_headers = { 'User-Agent' : user_agent }
-        req = urllib2.Request(requestUrl, None, http_headers)
-        # Make the submission (HTTP POST).
-        reqH = urllib2.urlopen(req, requestData.encode(encoding='utf_8', errors='strict'))
-        jobId = str(reqH.read(), 'utf-8')
-        reqH.close()
-    except urllib2.HTTPError as ex:
-        # Trap exception and output the document to get error message.
-        print (ex.read(), file=sys.stderr)
-        raise
-    printDebugMessage('serviceRun', 'jobId: ' + jobId, 2)
-    printDebugMessage('serviceRun', 'End', 1)
-    return jobId
+    return getDefaultClient().serviceRun(email, title, params)
 
 # Get job status
 def serviceGetStatus(jobId):
-    printDebugMessage('serviceGetStatus', 'Begin', 1)
-    printDebugMessage('serviceGetStatus', 'jobId: ' + jobId, 2)
-    requestUrl = baseUrl + '/status/' + jobId
-    printDebugMessage('serviceGetStatus', 'requestUrl: ' + requestUrl, 2)
-    status = restRequest(requestUrl)
-    printDebugMessage('serviceGetStatus', 'status: ' + status, 2)
-    printDebugMessage('serviceGetStatus', 'End', 1)
-    return status
+    return getDefaultClient().serviceGetStatus(jobId)
 
 # Print the status of a job
-def printGetStatus(jobId):
+def printGetStatus(jobId, client=None):
     printDebugMessage('printGetStatus', 'Begin', 1)
-    status = serviceGetStatus(jobId)
+    client = client or getDefaultClient()
+    status = client.serviceGetStatus(jobId)
     print (status)
     printDebugMessage('printGetStatus', 'End', 1)
-    
 
 # Get available result types for job
 def serviceGetResultTypes(jobId):
-    printDebugMessage('serviceGetResultTypes', 'Begin', 1)
-    printDebugMessage('serviceGetResultTypes', 'jobId: ' + jobId, 2)
-    requestUrl = baseUrl + '/resulttypes/' + jobId
-    printDebugMessage('serviceGetResultTypes', 'requestUrl: ' + requestUrl, 2)
-    xmlDoc = restRequest(requestUrl)
-    tree = etree.fromstring(xmlDoc)
-    printDebugMessage('serviceGetResultTypes', 'End', 1)
-    # Returns a list of elements with 'type' child elements
-    return tree.findall('type')
+    return getDefaultClient().serviceGetResultTypes(jobId)
 
 # Print list of available result types for a job.
-def printGetResultTypes(jobId):
+def printGetResultTypes(jobId, client=None):
     printDebugMessage('printGetResultTypes', 'Begin', 1)
-    resultTypeList = serviceGetResultTypes(jobId)
+    client = client or getDefaultClient()
+    resultTypeList = client.serviceGetResultTypes(jobId)
     for resultType in resultTypeList:
-        print (resultType['identifier'])
-        if(hasattr(resultType, 'label')):
-            print ("\t", resultType['label'])
-        if(hasattr(resultType, 'description')):
-            print ("\t", resultType['description'])
-        if(hasattr(resultType, 'mediaType')):
-            print ("\t", resultType['mediaType'])
-        if(hasattr(resultType, 'fileSuffix')):
-            print ("\t", resultType['fileSuffix'])
+        print (resultType.findtext('identifier'))
+        for field in ('label', 'description', 'mediaType', 'fileSuffix'):
+            if resultType.find(field) is not None:
+                print ("\t", resultType.findtext(field))
     printDebugMessage('printGetResultTypes', 'End', 1)
 
 # Get result
 def serviceGetResult(jobId, type_):
-    printDebugMessage('serviceGetResult', 'Begin', 1)
-    printDebugMessage('serviceGetResult', 'jobId: ' + jobId, 2)
-    printDebugMessage('serviceGetResult', 'type_: ' + type_, 2)
-    requestUrl = baseUrl + '/result/' + jobId + '/' + type_
-    result = restRequest(requestUrl)
-    printDebugMessage('serviceGetResult', 'End', 1)
-    return result
+    return getDefaultClient().serviceGetResult(jobId, type_)
 
 # Client-side poll
-def clientPoll(jobId):
-    printDebugMessage('clientPoll', 'Begin', 1)
-    result = 'PENDING'
-    while result == 'RUNNING' or result == 'PENDING':
-        result = serviceGetStatus(jobId)
-        print (result, file=sys.stderr)
-        if result == 'RUNNING' or result == 'PENDING':
-            time.sleep(checkInterval)
-    printDebugMessage('clientPoll', 'End', 1)
+def clientPoll(jobId, interval=None):
+    return getDefaultClient().clientPoll(jobId, interval)
 
 # Get result for a jobid
-def getResult(jobId):
-    printDebugMessage('getResult', 'Begin', 1)
-    printDebugMessage('getResult', 'jobId: ' + jobId, 1)
-    # Check status and wait if necessary
-    clientPoll(jobId)
-    # Get available result types
-    resultTypes = serviceGetResultTypes(jobId)
-    for resultType in resultTypes:
-        # Derive the filename for the result
-        suffix = resultType.find('fileSuffix').text
-        identifier = resultType.find('identifier').text
-        if options.outfile:
-            filename = options.outfile + '.' + identifier + '.' +suffix
-        else:
-            filename = jobId + '.' + identifier + '.' + suffix
-        # Write a result file. (If support for multiple selective outformats were to be supported
-        # it would go here)
-        if not options.outformat or options.outformat == identifier:
-            result = serviceGetResult(jobId, identifier)
-
-            if type(result) is bytes:
-                fmode = 'wb'
-            else:
-                fmode='w'
-
-            fh = open(filename, fmode)
-            
-            fh.write(result)
-            fh.close()
-            print (filename)
-    printDebugMessage('getResult', 'End', 1)
+def getResult(jobId, outfile=None, outformat=None, interval=None):
+    return getDefaultClient().getResult(jobId, outfile, outformat, interval)
 
 # Read a file
 def readFile(filename):
@@ -336,62 +646,89 @@ def readFile(filename):
     printDebugMessage('readFile', 'End', 1)
     return data
 
-# No options... print help.
-if numOpts < 2:
-    parser.print_help()
-# List parameters
-elif options.params:
-    printGetParameters()
-# Get parameter details
-elif options.paramDetail:
-    printGetParameterDetails(options.paramDetail)
-# Submit job
-elif options.email and not options.jobid:
-    params = {}
-    if len(args) > 0:
-        if os.access(args[0], os.R_OK): # Read file into content
-            params['sequence'] = readFile(args[0])
-        else: # Argument is a sequence id
-            params['sequence'] = args[0]
-    elif options.sequence: # Specified via option
-        if os.access(options.sequence, os.R_OK): # Read file into content
-            params['sequence'] = readFile(options.sequence)
-        else: # Argument is a sequence id
-            params['sequence'] = options.sequence
-    # Map flag options to boolean values.
-    #if options.crc:
-    #    params['crc'] = True
-    #elif options.nocrc:
-    #    params['crc'] = False
-    if options.goterms:
-        params['goterms'] = True
-    elif options.nogoterms:
-        params['goterms'] = False
-    if options.pathways:
-        params['pathways'] = True
-    elif options.nopathways:
-        params['pathways'] = False
-    # Add the other options (if defined)
-    if options.appl:
-        params['appl'] = re.split('[ \t\n,;]+', options.appl)
+# Run as a script, a thin wrapper around IPRScanClient. Options are only
+# parsed here so the module can be imported without side effects.
+def main():
+    global outputLevel, debugLevel
+    (options, args) = parser.parse_args()
+    if options.rateLimit is not None and options.rateLimit <= 0:
+        parser.error('--rateLimit must be above 0')
+
+    # Increase output level
+    if options.verbose:
+        outputLevel += 1
+
+    # Decrease output level
+    if options.quiet:
+        outputLevel -= 1
+
+    # Debug level
+    if options.debugLevel:
+        debugLevel = options.debugLevel
+
+    client = IPRScanClient(options.baseURL, rateLimit=options.rateLimit, maxRetries=options.retries)
+
+    # No options... print help.
+    if len(sys.argv) < 2:
+        parser.print_help()
+    # List parameters
+    elif options.params:
+        printGetParameters(client)
+    # Get parameter details
+    elif options.paramDetail:
+        printGetParameterDetails(options.paramDetail, client)
+    # Submit job
+    elif options.email and not options.jobid:
+        params = {}
+        if len(args) > 0:
+            if os.access(args[0], os.R_OK): # Read file into content
+                params['sequence'] = readFile(args[0])
+            else: # Argument is a sequence id
+                params['sequence'] = args[0]
+        elif options.sequence: # Specified via option
+            if os.access(options.sequence, os.R_OK): # Read file into content
+                params['sequence'] = readFile(options.sequence)
+            else: # Argument is a sequence id
+                params['sequence'] = options.sequence
+        # Map flag options to boolean values.
+        #if options.crc:
+        #    params['crc'] = True
+        #elif options.nocrc:
+        #    params['crc'] = False
+        if options.goterms:
+            params['goterms'] = True
+        elif options.nogoterms:
+            params['goterms'] = False
+        if options.pathways:
+            params['pathways'] = True
+        elif options.nopathways:
+            params['pathways'] = False
+        # Add the other options (if defined)
+        if options.appl:
+            params['appl'] = re.split('[ \t\n,;]+', options.appl)
     
-    # Submit the job
-    jobid = serviceRun(options.email, options.title, params)
-    if options.async: # Async mode
-        print (jobid)
-    else: # Sync mode
-        print (jobid, file=sys.stderr)
-        time.sleep(5)
-        getResult(jobid)
-# Get job status
-elif options.status and options.jobid:
-    printGetStatus(options.jobid)
-# List result types for job
-elif options.resultTypes and options.jobid:
-    printGetResultTypes(options.jobid)
-# Get results for job
-elif options.polljob and options.jobid:
-    getResult(options.jobid)
-else:
-    print ('Error: unrecognised argument combination', file=sys.stderr)
-    parser.print_help()
\ No newline at end of file
+        # Submit the job
+        jobid = client.serviceRun(options.email, options.title, params)
+        if options.async_mode: # Async mode
+            print (jobid)
+        else: # Sync mode
+            print (jobid, file=sys.stderr)
+            time.sleep(5)
+            client.getResult(jobid, options.outfile, options.outformat)
+    # Get job status
+    elif options.status and options.jobid:
+        printGetStatus(options.jobid, client)
+    # List result types for job
+    elif options.resultTypes and options.jobid:
+        printGetResultTypes(options.jobid, client)
+    # Get results for job
+    elif options.polljob and options.jobid:
+        client.getResult(options.jobid, options.outfile, options.outformat)
+    else:
+        print ('Error: unrecognised argument combination', file=sys.stderr)
+        parser.print_help()
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, sys, time, shutil, tempfile, subprocess, multiprocessing, threading
+
+try:
+    from . import IPRScan
+    from .job_scheduler import JobScheduler, XML_RESULT_SUFFIX, pack_jobs, split_batch_results
+    from .metrics import registry as metrics_registry
+except ImportError:
+    import IPRScan
+    from job_scheduler import JobScheduler, XML_RESULT_SUFFIX, pack_jobs, split_batch_results
+    from metrics import registry as metrics_registry
+
+
+"""Ways of running InterProScan jobs for iprscan(), see Backend.__doc__"""
+
+
+class Backend(object):
+    """Runs jobs for iprscan().
+
+    run(jobs, params, on_submitted, on_finished, on_failed, metrics) takes
+    an iterable of job_scheduler.Job and the options sent with every job
+    (appl, goterms, pathways), and returns once they're all done. The
+    callbacks are the same as JobScheduler's: on_submitted(job),
+    on_finished(job, written_file_paths) and on_failed(job, exception).
+    Measurements go to metrics, a metrics.Metrics, or metrics.registry
+    if it's None.
+    Results of a job are written starting with job.out_path, the XML as
+    job.out_path + '.xml.xml'.
+    """
+
+    def run(self, jobs, params, on_submitted = None, on_finished = None, on_failed = None,
+            metrics = None):
+        raise NotImplementedError
+
+
+class RestBackend(Backend):
+    """Jobs sent to the InterProScan REST service by a JobScheduler, one
+    sequence at a time unless batch_records or batch_residues are given,
+    see iprscan() for the arguments."""
+
+    def __init__(self, email, base_url = None, max_concurrent_jobs = 20, polling_time = 10,
+                 outformat = None, rate_limit = None, max_retries = None,
+                 batch_records = None, batch_residues = None):
+        self.email = email
+        self.base_url = base_url
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.polling_time = polling_time
+        self.outformat = outformat
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.batch_records = batch_records
+        self.batch_residues = batch_residues
+
+    def run(self, jobs, params, on_submitted = None, on_finished = None, on_failed = None,
+            metrics = None):
+        metrics = metrics_registry if metrics is None else metrics
+        with IPRScan.IPRScanClient(self.base_url, metrics = metrics, rateLimit = self.rate_limit,
+                                   maxRetries = self.max_retries) as client:
+            scheduler = JobScheduler(
+                client, self.email, params,
+                max_concurrent_jobs = self.max_concurrent_jobs,
+                min_interval = self.polling_time, max_interval = self.polling_time*6,
+                outformat = self.outformat,
+                on_submitted = on_submitted, on_finished = on_finished, on_failed = on_failed,
+                metrics = metrics,
+                batch_records = self.batch_records, batch_residues = self.batch_residues,
+            )
+            scheduler.run(jobs)
+
+
+def interproscan_args(params):
+    """interproscan.sh options for the appl, goterms and pathways params."""
+    args = []
+    if params.get('appl'):
+        args += ['-appl', ','.join(params['appl'])]
+    if params.get('goterms'):
+        args.append('-goterms')
+    if params.get('pathways'):
+        args.append('-pa')
+    return args
+
+
+def _run_batch(args):
+    # Run interproscan.sh on one batch of (job key, sequence, xml path) and
+    # split its XML into a file per protein. Run in a worker process.
+    # Returns (batch number, [keys of the jobs with results], error message or None, seconds)
+    batch_n, batch, command, work_dir = args
+    t = time.perf_counter()
+    tmp = tempfile.mkdtemp(prefix='batch%d_' % batch_n, dir=work_dir)
+    try:
+        fasta = os.path.join(tmp, 'input.faa')
+        out = os.path.join(tmp, 'output.xml')
+        with open(fasta, 'w') as f:
+            for key, seq, _ in batch:
+                f.write('>{}\n{}\n'.format(key, seq))
+        proc = subprocess.run(command + ['-i', fasta, '-f', 'XML', '-o', out, '-T', tmp],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if proc.returncode != 0 or not os.path.isfile(out):
+            message = proc.stdout.decode(errors='replace').strip().splitlines()[-5:]
+            return batch_n, [], 'exit status {}: {}'.format(proc.returncode, ' | '.join(message)), time.perf_counter()-t
+        # Proteins are identified by the job key given as the FASTA title
+        done = split_batch_results(out, {key: path for key, _, path in batch})
+        return batch_n, done, None, time.perf_counter()-t
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+class LocalBackend(Backend):
+    """Runs a locally installed InterProScan, no job limits or network.
+
+    Jobs are grouped into FASTA files of up to batch_size sequences
+    (and batch_residues residues) and interproscan.sh is run on each,
+    `processes` at a time, from a pool of worker processes. The XML output is split up by protein and
+    written as job.out_path + '.xml.xml', the same names used for REST
+    results, so tabulate_iprs_results reads them in the same way. Only
+    XML is produced.
+
+    Args:
+    executable (Default: 'interproscan.sh'):
+        Path of interproscan.sh, or anything taking the same -i, -f, -o
+        and -T options.
+
+    batch_size (Default: 100):
+        Sequences per run of interproscan.sh.
+
+    batch_residues (Default: None):
+        Most residues per run of interproscan.sh, so batches of long
+        proteins take about as long as batches of short ones.
+
+    processes (Default: 1):
+        interproscan.sh runs at once.
+
+    extra_args (Default: None):
+        List of extra arguments, e.g. ['-cpu', '4', '-dp'].
+
+    work_dir (Default: None):
+        Where batch FASTA and XML files are made, the system temp
+        directory by default.
+    """
+
+    def __init__(self, executable = 'interproscan.sh', batch_size = 100, processes = 1,
+                 extra_args = None, work_dir = None, batch_residues = None):
+        self.executable = executable
+        self.batch_size = batch_size
+        self.batch_residues = batch_residues
+        self.processes = processes
+        self.extra_args = list(extra_args or [])
+        self.work_dir = work_dir
+
+    def batches(self, jobs):
+        """Lists of up to batch_size jobs and batch_residues residues."""
+        return pack_jobs(jobs, self.batch_size, self.batch_residues)
+
+    def run(self, jobs, params, on_submitted = None, on_finished = None, on_failed = None,
+            metrics = None):
+        metrics = metrics_registry if metrics is None else metrics
+        command = [self.executable] + interproscan_args(params) + self.extra_args
+        in_flight = {}
+        # The pool takes tasks as fast as they come, only make a couple of
+        # batches per process ahead so jobs are read from the iterable lazily
+        slots = threading.Semaphore((self.processes or os.cpu_count())*2)
+
+        def tasks():
+            for batch_n, batch in enumerate(self.batches(jobs)):
+                slots.acquire()
+                for job in batch:
+                    job.job_id = 'local-{}'.format(batch_n)
+                    if on_submitted:
+                        on_submitted(job)
+                in_flight[batch_n] = batch
+                print('Batch', batch_n, 'of', len(batch), 'sequences started', file=sys.stderr)
+                yield (batch_n, [(job.key, job.seq, job.out_path+XML_RESULT_SUFFIX) for job in batch],
+                       command, self.work_dir)
+
+        with multiprocessing.Pool(self.processes) as pool:
+            for batch_n, done, error, secs in pool.imap_unordered(_run_batch, tasks()):
+                metrics.observe('local.batch', secs, batch=batch_n, error=error is not None)
+                batch = in_flight.pop(batch_n)
+                slots.release()
+                done = set(done)
+                print('Batch', batch_n, 'finished,', len(done), 'of', len(batch), 'results', file=sys.stderr)
+                for job in batch:
+                    if job.key in done:
+                        metrics.incr('jobs.finished', job_id=job.job_id)
+                        if on_finished:
+                            on_finished(job, [job.out_path+XML_RESULT_SUFFIX])
+                    else:
+                        ex = RuntimeError(error or 'no results for this sequence in the batch output')
+                        print('Job for', job.file_names[0], 'failed:', repr(ex), file=sys.stderr)
+                        metrics.incr('jobs.failed', job_id=job.job_id)
+                        if on_failed:
+                            on_failed(job, ex)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, sys, mmap, json, array
+
+try:
+    from .file_utils import atomic_open
+except ImportError:
+    from file_utils import atomic_open
+
+
+"""Byte offset index of FASTA records kept next to the FASTA, see FastaIndex.__doc__"""
+
+INDEX_SUFFIX = '.iprsidx'
+INDEX_VERSION = 1
+
+
+def scan_offsets(mm):
+    """array of the byte offset of every '>' starting a record in mm,
+    then the end of the data."""
+    offsets = array.array('Q')
+    size = len(mm)
+    pos = 0 if mm[:1] == b'>' else mm.find(b'\n>')
+    if pos > 0:
+        pos += 1
+    while pos != -1 and pos < size:
+        offsets.append(pos)
+        pos = mm.find(b'\n>', pos)
+        if pos != -1:
+            pos += 1
+    offsets.append(size)
+    return offsets
+
+
+def parse_record(data):
+    """(description, sequence) from the bytes of one record, as
+    Bio.SeqIO gives for record.description and str(record.seq)."""
+    # Titles from other tools aren't always UTF-8, a bad byte shouldn't
+    # stop the run
+    text = data.decode(errors='replace')
+    title, _, body = text.partition('\n')
+    return title[1:].strip(), ''.join(body.split())
+
+
+class FastaIndex(object):
+    """Index of where each record starts in a FASTA file, built in one
+    pass and saved as fasta_path + '.iprsidx' so later runs don't read
+    the FASTA to count or skip records. The index stores the FASTA's
+    size and mtime and is rebuilt if they change. Records are read
+    through an mmap of the FASTA, so getting a range of records only
+    touches those records.
+
+    Args:
+    fasta_path:
+        The FASTA file.
+
+    index_path (Default: None):
+        Where to keep the index, next to the FASTA by default. If it
+        can't be written the index is only kept in memory.
+    """
+
+    def __init__(self, fasta_path, index_path = None):
+        self.fasta_path = os.path.abspath(fasta_path)
+        self.index_path = index_path or self.fasta_path + INDEX_SUFFIX
+        self._file = open(self.fasta_path, 'rb')
+        st = os.fstat(self._file.fileno())
+        self._stamp = {'version': INDEX_VERSION, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        # mmap can't map empty files
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b''
+        self.offsets = self._load()
+        if self.offsets is None:
+            self.offsets = scan_offsets(self._mm)
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                stamp = json.loads(f.readline())
+                if stamp != self._stamp:
+                    return None
+                offsets = array.array('Q')
+                offsets.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        return offsets
+
+    def _save(self):
+        try:
+            with atomic_open(self.index_path) as f:
+                f.write(json.dumps(self._stamp).encode() + b'\n')
+                self.offsets.tofile(f)
+        except OSError as ex:
+            print('Could not save FASTA index:', ex, file=sys.stderr)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def record(self, i):
+        """(description, sequence) of record i, from 0."""
+        return parse_record(self._mm[self.offsets[i]:self.offsets[i+1]])
+
+    def records(self, start = 0, stop = None):
+        """Yields (description, sequence) of records start to stop-1."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self.record(i)
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, shutil, tempfile, contextlib
+
+
+"""Writing files so a partly written one is never seen under its real name,
+and telling results files from anything else in a results directory"""
+
+
+@contextlib.contextmanager
+def atomic_open(path):
+    """Binary file to write path through. It's a hidden temporary file in
+    the same directory, renamed to path when the with block finishes or
+    removed if it raises, so readers (and resumed runs) never see a
+    partial file.
+
+        with atomic_open(path) as f:
+            f.write(data)
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def is_results_file(name):
+    """True for the name of an XML results file. Hidden files are
+    skipped, they're partial downloads or the combined results of a
+    batch (job_scheduler.BatchJob) left behind by a crash."""
+    return name.endswith('xml') and not name.startswith('.')
+
+
+def atomic_write(path, data):
+    """Write bytes to path with atomic_open."""
+    with atomic_open(path) as f:
+        f.write(data)
+
+
+def atomic_copy(src, dest):
+    """Copy the file at src to dest with atomic_open."""
+    with open(src, 'rb') as inp, atomic_open(dest) as out:
+        shutil.copyfileobj(inp, out)
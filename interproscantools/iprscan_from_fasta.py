@@ -1,13 +1,33 @@
 #!/usr/bin/env python3
 __author__ = 'https://github.com/johncthomas'
 
-from Bio import SeqIO
-import os, sys, argparse
+import os, sys, argparse, re, shutil, threading, queue, collections
+import http.client
 
-from subprocess import Popen
-import time
 #import xml.sax
 
+try:
+    from .result_cache import ResultCache, DEFAULT_MAX_BYTES, sequence_key
+    from . import job_manifest
+    from .job_scheduler import Job, XML_RESULT_SUFFIX
+    from .backends import RestBackend, LocalBackend
+    from .metrics import Metrics, registry as metrics_registry
+    from . import precalc as precalc_lookup
+    from .fasta_index import FastaIndex
+    from .file_utils import atomic_write
+    from . import sharding
+except ImportError:
+    # Running as a script from within the package directory
+    from result_cache import ResultCache, DEFAULT_MAX_BYTES, sequence_key
+    import job_manifest
+    from job_scheduler import Job, XML_RESULT_SUFFIX
+    from backends import RestBackend, LocalBackend
+    from metrics import Metrics, registry as metrics_registry
+    import precalc as precalc_lookup
+    from fasta_index import FastaIndex
+    from file_utils import atomic_write
+    import sharding
+
 
 """see iprscan_from_fasta.iprscan.__doc__"""
 
@@ -16,6 +36,12 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
             single_results_format = False,
             max_concurrent_jobs = 20, polling_time = 10,
             record_start_stop = None,
+            appl = None, goterms = None, pathways = None,
+            cache_dir = None, cache_max_bytes = DEFAULT_MAX_BYTES,
+            resume = False, results_formats = None, base_url = None,
+            metrics_file = None, rate_limit = None, max_retries = None, metrics = None,
+            precalc = None, backend = None, lookahead = 100, shard = None,
+            batch_records = None, batch_residues = None, stop_event = None,
             __filenametest = False):
     """
     Takes a FASTA file path, sends the sequences contained
@@ -47,13 +73,115 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
         a single format here (e.g 'svg'). If you want more than one
         it's probably easier to get them all and delete the ones you
         don't want. Other functions I've written use XML results.
-        SVG are pretty.
+        SVG are pretty. See results_formats for getting a few.
 
     max_concurrent_jobs (Default: 20; max: 20):
         Maximum jobs sent to IPRScan concurrently.
 
     polling_time (Default: 10):
-        How often the status of running jobs are checked, in seconds.
+        Shortest time between checks on the status of a running job,
+        in seconds. Checks back off to 6x this for long running jobs.
+
+    appl, goterms, pathways (Default: None):
+        Passed on to IPRScan. appl is a list (or comma separated
+        string) of signature methods, goterms and pathways are bools.
+        None leaves it to the server's defaults.
+
+    cache_dir (Default: None):
+        Directory of a ResultCache. XML results are stored there keyed
+        by sequence, so identical sequences in this or any later run
+        are copied from the cache instead of being sent to IPRScan.
+        Cache hits only provide the XML results.
+
+    cache_max_bytes (Default: 1 GB):
+        Size cap of the cache, least recently used results are
+        deleted once it's exceeded.
+
+    resume (Default: False):
+        Every job is logged to iprscan_manifest.jsonl in out_dir as
+        it's submitted and finished. With resume, sequences whose
+        results are already in out_dir are skipped and jobs that were
+        still running are picked up by their job ID rather than being
+        sent again. Doesn't prompt about overwriting files.
+
+    results_formats (Default: None):
+        List of result types to download, e.g. ['xml', 'svg']. Only
+        these are fetched, in parallel and streamed to disk. Overrides
+        single_results_format. tabulate_iprs_results only needs 'xml'.
+
+    base_url (Default: None):
+        URL of the InterProScan REST service, IPRScan.baseUrl (EBI) by
+        default. E.g. the url of a mock_server.MockIPRScanServer.
+
+    metrics_file (Default: None):
+        JSON-lines file that request timings, job queue waits and run
+        times etc. are appended to as they happen, see metrics.Metrics.
+        A summary is printed at the end either way.
+
+    metrics (Default: None):
+        metrics.Metrics the run reports to. By default each call gets a
+        new one, so the summary only covers this run, with the
+        listeners of metrics.registry added to it.
+
+    rate_limit (Default: None):
+        Maximum requests per second sent to the server, over all the
+        running jobs, above 0. No limit by default.
+
+    max_retries (Default: None):
+        Times a status check or download is retried, with jittered
+        exponential backoff, after a 5xx/429 response or timeout.
+        IPRScan.maxRetries (5) by default.
+
+    precalc (Default: None):
+        Where to look up precalculated matches by sequence MD5 before
+        anything is submitted: a URL of a lookup service, a directory
+        of <md5>.xml files, an InterProScan XML file of many proteins,
+        or a precalc.PrecalcLookup. Only sequences not found are
+        scanned. Precalculated results are whatever the source has,
+        appl etc. aren't applied to them.
+
+    backend (Default: None):
+        backends.Backend that runs the jobs. By default a RestBackend
+        sends them to the InterProScan REST service (base_url) using
+        email, max_concurrent_jobs, polling_time, the results formats,
+        rate_limit and max_retries. Pass a backends.LocalBackend to run
+        a local installation of InterProScan instead, those arguments
+        are then ignored and only XML results are made.
+
+    lookahead (Default: 100):
+        Jobs are made from the FASTA as they're needed, with up to this
+        many ready ahead of the backend.
+
+    shard (Default: None):
+        Only run shard i of N of the sequences, given as 'i/N' or
+        (i, N) with i from 1, for splitting a FASTA between machines.
+        Sequences are split by their hash (sharding.shard_index) so
+        every machine gets the same split as long as appl, goterms and
+        pathways are the same, and records keep their numbering from
+        the whole FASTA. Give each shard its own out_dir and combine
+        them with sharding.merge_shards. See also iprscan_work_queue.
+
+    batch_records, batch_residues (Default: None):
+        Pack up to batch_records sequences and batch_residues residues
+        (either or both) into each job as multi-FASTA, which saves
+        the per job overhead for short proteins. Only for servers that
+        take more than one sequence per job, such as
+        mock_server.MockIPRScanServer; EBI's takes one. Only XML results
+        are made, the XML of a job is split up into each record's file.
+        For a LocalBackend use its batch_size and batch_residues.
+
+    stop_event (Default: None):
+        threading.Event, once it's set no more jobs are started. Jobs
+        that are already running are finished and the failed records
+        are returned but not written to iprscan_failed.faa. Used by
+        iprscan_work_queue to give up a shard another worker has taken.
+
+    Records that still can't be scanned are listed at the end and
+    written to iprscan_failed.faa in out_dir, with their results file
+    names as the FASTA titles. Run again with resume to retry them, or
+    submit that file.
+
+    Returns the list of results file names that failed.
 
     *Note on file names*:
     All generated files are numbered so if you supply a prefix and
@@ -68,11 +196,9 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
 
     # Goes through the fasta getting AA sequences and constructing the eventual filenames
     # based on the arguments given.
-    # Subprocess objects are created using Popen that run IPRScan.py from the command line
-    # with the appropriate arguments. IPRScan.py sends the data to the
-    # InterPro server. Subprocesses generated are put
-    # into current_jobs and periodically polled to
-    # check if they've finished.
+    # Jobs are then run by a backend, by default a RestBackend whose
+    # JobScheduler sends the data to the InterPro server, polls all the
+    # running jobs and saves the results from this one process.
 
 
     #check we have filenames
@@ -96,7 +222,7 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
 
     # Check for potential results files and warn about overwriting
     filesinout = [f for f in os.listdir(out_dir) if ('.svg' in f or '.xml' in f) and file_name_prefix in f]
-    if filesinout:
+    if filesinout and not resume:
         print('Possible results files found in results directory, e.g.:')
         for f in filesinout[:5]:
             print(f)
@@ -107,14 +233,12 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
             return 0
 
 
-    # count records, set r_s_s if required, inform user of record count
+    # count records, set r_s_s if required, inform user of record count.
+    # The FastaIndex of where records start is saved next to the FASTA
+    # so it's only read through once, here or in an earlier run.
     fasta_file_path = os.path.abspath(fasta_file_path)
-    record_count = 0
-    with open(fasta_file_path) as f:
-        for line in f.readlines():
-            #print(line)
-            if line[0] == '>':
-                record_count+=1
+    fasta = FastaIndex(fasta_file_path)
+    record_count = len(fasta)
     count_figures = len(str(record_count))
 
     if record_start_stop is not None:
@@ -123,31 +247,35 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
 
 
     print('FastA file contains', record_count, 'records.')
-
-    # Format of the command used to run IPRScan.py
-    if single_results_format:
-        iprscan_s = 'python IPRscan.py --email {} --outformat {} --sequence {} --outfile "{}"'.format(
-            email, single_results_format, '{}', '{}'
-        )
-    else:
-        iprscan_s = 'python IPRscan.py --email {} --sequence {} --outfile "{}"'.format(
-            email, '{}', '{}'
-        )
+    if shard is not None:
+        shard = sharding.parse_shard(shard)
+        print('Running shard {} of {}.'.format(*shard))
 
     # Format string for the results file name
     file_name_template = file_name_prefix+'_{}{}' if file_name_prefix else '{}{}'
 
-    # Go through the fasta records submitting jobs
-    fasta_records = SeqIO.parse(fasta_file_path, 'fasta')
-
-    # get job info from FastA. jobs = [(seq, filename), ...]
-    jobs = []
+    # Options sent with every job
+    job_params = {}
+    if appl:
+        if isinstance(appl, str):
+            appl = re.split('[ \t\n,;]+', appl)
+        job_params['appl'] = list(appl)
+    if goterms is not None:
+        job_params['goterms'] = goterms
+    if pathways is not None:
+        job_params['pathways'] = pathways
+
+    # Records outside of the range defined by record_start_stop (if given)
+    # are never read.
+    start, stop = 0, record_count
+    if record_start_stop:
+        start, stop = record_start_stop[0], record_start_stop[1]+1
 
     FunctionType = type(lambda x: x)
 
-    for job_count, record in enumerate(fasta_records):
-        # Skip records if outside of range defined by record_start_stop (or r_s_s is None)
-        if not record_start_stop or record_start_stop[0] <= job_count <= record_start_stop[1]:
+    def iter_records():
+        # (seq, filename) of each record, read as they're needed
+        for job_count, (description, seq) in enumerate(fasta.records(start, stop), start):
 
             # Get the results file name
             # Add leading zeroes to the number string
@@ -159,9 +287,9 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
             # get the rest of the file name
             if use_fasta_descriptions:
                 if type(use_fasta_descriptions) == FunctionType:
-                    desc = use_fasta_descriptions(record.description)
+                    desc = use_fasta_descriptions(description)
                 else:
-                    desc = record.description
+                    desc = description
                 for banned_char in '<>:"/\\|?*':
                     desc = desc.replace(banned_char, '_')
                 if auto_numbering:
@@ -169,56 +297,327 @@ def iprscan(fasta_file_path, out_dir, email, file_name_prefix ='',
             else:
                 desc = ''
 
-            file_name = file_name_template.format(num_string, desc)
-            # add the sequence and filename to the jobs list
-            jobs.append((str(record.seq), file_name))
+            yield seq, file_name_template.format(num_string, desc)
 
-        elif job_count > record_start_stop[1]:
-            break
     if __filenametest:
-        for j in jobs:
+        for j in iter_records():
             print(j)
+        fasta.close()
         return 0
-    # Function used while polling current_jobs to add a wait
-    def poll_wait(job):
-        # if new_job == 'test':
-        #     return True
-        time.sleep(polling_time / max_concurrent_jobs)
-        return job.poll()
-
-    # Where  currently running jobs will be stored while
-    # waiting for the interpro server
-    current_jobs = []
-    jobs = iter(jobs)
-    done = False
-
-    while not done:
-        # subprocess.poll() returns None while waiting for interpro
-        current_jobs = [subprocess for subprocess in current_jobs if poll_wait(subprocess) is None]
-        while len(current_jobs) < max_concurrent_jobs:
+
+    if metrics is None:
+        metrics = Metrics()
+        for listener in metrics_registry.listeners:
+            metrics.add_listener(listener)
+
+    manifest = job_manifest.JobManifest(out_dir)
+    previous = manifest.load() if resume else {}
+    cache = ResultCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    # Jobs are made from the FASTA records as the backend asks for them, by
+    # a generator pipeline run in another thread a bounded number of jobs
+    # ahead, so submission starts straight away and only the jobs in flight
+    # hold their sequences. Dedup still needs a small entry (key, result
+    # paths and a file name) per unique sequence finished, so memory grows
+    # slowly with the number of unique sequences, not with their lengths.
+    #
+    # Identical sequences are only submitted once, records whose sequence
+    # has already been seen have their file name added to that job, or get
+    # its results copied to their file name if it's done. Sequences with
+    # results from an earlier run (resume), the cache or the precalc lookup
+    # are finished without being sent to the backend.
+    lock = threading.Lock()
+    # key: Job, for unique sequences that aren't done
+    pending = {}
+    # key: (results paths, file name they were written for)
+    done = {}
+    # key: Job, later records with the same sequence are added to it so
+    # they're reported as failed too
+    failed = {}
+    counts = collections.Counter()
+
+    def finished(job, written, cache_result = True):
+        with lock:
+            pending.pop(job.key, None)
+            done[job.key] = (tuple(written), job.file_names[0])
+            file_names = list(job.file_names)
+        copy_results(written, out_dir, file_names)
+        manifest.record(job.key, job_manifest.FINISHED, job.job_id, file_names, written)
+        xml_path = job.out_path+XML_RESULT_SUFFIX
+        if cache_result and cache is not None and os.path.isfile(xml_path):
+            cache.put(job.key, xml_path)
+
+    def add_record(key, file_name):
+        # Attach a record to an existing job, False if the sequence is new
+        with lock:
+            if key in pending:
+                pending[key].file_names.append(file_name)
+                return True
+            if key in failed:
+                failed[key].file_names.append(file_name)
+                return True
+            result = done.get(key)
+            if result is None:
+                return False
+        written, source_name = result
+        if file_name != source_name:
+            copy_results(written, out_dir, [source_name, file_name])
+        return True
+
+    def iter_new_jobs():
+        for seq, file_name in iter_records():
+            key = sequence_key(seq, appl, goterms, pathways)
+            if shard is not None and not sharding.in_shard(key, shard):
+                counts['other shards'] += 1
+                continue
+            counts['records'] += 1
+            if add_record(key, file_name):
+                continue
+            counts['unique'] += 1
+            job = Job(key, seq, [file_name], os.path.join(out_dir, file_name))
+            entry = previous.get(key)
+            if job_manifest.is_complete(entry):
+                # Results might be needed under a new file name
+                with lock:
+                    done[key] = (tuple(entry['outputs']), entry['file_names'][0])
+                if file_name not in entry['file_names']:
+                    copy_results(entry['outputs'], out_dir, [entry['file_names'][0], file_name])
+                counts['finished before'] += 1
+                continue
+            with lock:
+                pending[key] = job
+            if entry is not None and entry['state'] == job_manifest.SUBMITTED:
+                job.job_id = entry['job_id']
+                job.resumed = True
+                counts['resumed'] += 1
+            elif cache is not None and cache.get(key, job.out_path+XML_RESULT_SUFFIX):
+                finished(job, [job.out_path+XML_RESULT_SUFFIX], cache_result = False)
+                metrics.incr('jobs.cached')
+                counts['cached'] += 1
+                continue
+            yield job
+        fasta.close()
+
+    def iter_precalc_misses(jobs, lookup):
+        # Check for precalculated matches by MD5 in batches, only the misses
+        # are scanned. It's only a shortcut, if the lookup fails the batch
+        # is scanned as normal.
+        warned = []
+        def check(batch):
+            md5s = [precalc_lookup.sequence_md5(job.seq) for job in batch]
             try:
-                seq, file_name = next(jobs)
-            except StopIteration:
-                done = True
-                break
-            # Call Popen() with the formated string containing all the args
-            job_string = iprscan_s.format( seq, os.path.join(out_dir,file_name) )
-            new_job = Popen(job_string)
-            #new_job = 'test'
-            current_jobs.append(new_job)
-
-            print('# jobs running:', len(current_jobs))
-            time.sleep(0.5)
-
-    # All jobs added, keep the python program running, this
-    # might be required to get the results from the IPRS server
-    # server, or it might not. I dunno but it seems sensible to keep it going.
-    finished = False
-    while not finished:
-        time.sleep(polling_time)
-        current_jobs = [subprocess for subprocess in current_jobs if subprocess.poll() is None]
-        if not current_jobs:
-            finished = True
+                with metrics.timer('precalc.lookup', sequences=len(md5s)):
+                    hits = lookup.lookup_all(set(md5s)) if batch else {}
+            except (OSError, http.client.HTTPException) as ex:
+                metrics.incr('precalc.errors', error=repr(ex))
+                if not warned:
+                    print('Warning: precalculated match lookup failed, scanning the sequences instead:',
+                          repr(ex), file=sys.stderr)
+                    warned.append(ex)
+                hits = {}
+            for job, md5 in zip(batch, md5s):
+                if md5 in hits:
+                    atomic_write(job.out_path+XML_RESULT_SUFFIX, hits[md5])
+                    finished(job, [job.out_path+XML_RESULT_SUFFIX])
+                    metrics.incr('jobs.precalculated')
+                    counts['precalculated'] += 1
+                else:
+                    yield job
+        batch = []
+        try:
+            for job in jobs:
+                if job.job_id is not None:
+                    # Already running
+                    yield job
+                    continue
+                batch.append(job)
+                if len(batch) == lookup.batch_size:
+                    yield from check(batch)
+                    batch = []
+            yield from check(batch)
+        finally:
+            if lookup is not precalc:
+                lookup.close()
+
+    jobs = iter_new_jobs()
+    if precalc is not None:
+        jobs = iter_precalc_misses(jobs, precalc_lookup.open_lookup(precalc, metrics))
+
+    # The backend, by default a RestBackend where a JobScheduler submits
+    # jobs and polls all the running ones from a single loop using one
+    # IPRScanClient, so HTTP connections are reused between jobs. Results
+    # are saved, copied to duplicate records, cached and logged in the
+    # manifest by the callbacks.
+    def on_submitted(job):
+        with lock:
+            file_names = list(job.file_names)
+        manifest.record(job.key, job_manifest.SUBMITTED, job.job_id, file_names)
+
+    def on_finished(job, written):
+        finished(job, written)
+
+    def on_failed(job, ex):
+        with lock:
+            pending.pop(job.key, None)
+            failed[job.key] = job
+            file_names = list(job.file_names)
+        manifest.record(job.key, job_manifest.FAILED, job.job_id, file_names)
+
+    if backend is None:
+        backend = RestBackend(
+            email, base_url,
+            max_concurrent_jobs = max_concurrent_jobs, polling_time = polling_time,
+            outformat = results_formats or single_results_format or None,
+            rate_limit = rate_limit, max_retries = max_retries,
+            batch_records = batch_records, batch_residues = batch_residues,
+        )
+
+    if metrics_file:
+        metrics.open_file(metrics_file)
+    try:
+        backend.run(
+            prefetch(jobs, lookahead, stop_event), job_params,
+            on_submitted = on_submitted, on_finished = on_finished, on_failed = on_failed,
+            metrics = metrics,
+        )
+    finally:
+        if shard is not None:
+            print(counts['other shards'], 'records left to other shards.')
+        print(counts['records'], 'records contain', counts['unique'], 'unique sequences,',
+              counts['records']-counts['unique'], 'submissions saved by deduplication.')
+        for what in ('finished before', 'resumed', 'cached', 'precalculated'):
+            if counts[what]:
+                print(counts[what], 'sequences', what)
+        metrics.print_summary(sys.stderr)
+        if metrics_file:
+            metrics.close()
+
+    if stop_event is not None and stop_event.is_set():
+        # out_dir may belong to someone else now
+        print('Stopped before all the jobs were started.', file=sys.stderr)
+        return [f for job in failed.values() for f in job.file_names]
+    return report_failed(list(failed.values()), os.path.join(out_dir, job_manifest.FAILED_FASTA_NAME))
+
+
+def iprscan_work_queue(fasta_file_path, out_dir, email, queue_dir, shards,
+                       stale_after = 600, **kwargs):
+    """
+    Run shards of a FASTA taken from a sharding.WorkQueue in queue_dir
+    until none are left, so any number of machines sharing queue_dir
+    can work through one FASTA, each with its own email, and the ones
+    that finish early take more shards. Each shard is run by iprscan()
+    with resume into its own directory in queue_dir. The worker that
+    finishes the last shard merges them all into out_dir.
+
+    Args:
+    fasta_file_path, email:
+        As for iprscan(), the FASTA should be at the same path for
+        every worker.
+
+    out_dir:
+        Where the shards are merged to, or None to leave merging to
+        sharding.merge_shards.
+
+    queue_dir:
+        Directory on a filesystem shared by all the workers.
+
+    shards:
+        Number of pieces the FASTA is split into, the same for every
+        worker. A few times the number of workers evens out the load.
+
+    stale_after (Default: 600):
+        Seconds after a worker stops updating its lock that another
+        can take over its shard, see sharding.WorkQueue.
+
+    Other keyword arguments are passed on to iprscan().
+
+    Returns the list of results file names that failed, in the shards
+    run by this worker or, if it merged, in all of them.
+    """
+    work_queue = sharding.WorkQueue(queue_dir, shards, stale_after)
+    kwargs.pop('resume', None)
+    failed = []
+
+    def run_shard(i, n, shard_dir, lost):
+        print('Worker', work_queue.owner, 'running', sharding.shard_dir_name(i, n))
+        shard_failed = iprscan(fasta_file_path, shard_dir, email, shard = (i, n), resume = True,
+                               stop_event = lost, **kwargs)
+        if not lost.is_set():
+            failed.extend(shard_failed)
+
+    did = work_queue.run(run_shard)
+    print('Worker', work_queue.owner, 'ran', len(did), 'shards, no more left to claim.')
+    if out_dir is not None and work_queue.is_finished() and work_queue.lock_merge():
+        return sharding.merge_shards(work_queue.shard_dirs(), out_dir)
+    return failed
+
+
+def prefetch(iterable, size, stop = None):
+    """Iterate through iterable in another thread, keeping up to size
+    items ready. Exceptions are raised in the caller. Ends early once
+    the threading.Event stop is set, the items made ahead are dropped."""
+    items = queue.Queue(maxsize=max(1, size))
+    end = object()
+    closed = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+                if closed.is_set():
+                    return
+        except BaseException as ex:
+            items.put((end, ex))
+        else:
+            items.put((end, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while stop is None or not stop.is_set():
+            item, ex = items.get()
+            if item is end:
+                if ex is not None:
+                    raise ex
+                return
+            yield item
+    finally:
+        # Unblock the thread if it's waiting to put, it stops after that
+        closed.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def report_failed(failed_jobs, failed_fasta_path):
+    """Print the records of failed jobs and write them to a FASTA file
+    for resubmission. An old file is removed if nothing failed.
+    Returns the failed file names."""
+    failed_names = [f for job in failed_jobs for f in job.file_names]
+    if not failed_jobs:
+        if os.path.isfile(failed_fasta_path):
+            os.remove(failed_fasta_path)
+        return failed_names
+    print(len(failed_names), 'records failed:', file=sys.stderr)
+    with open(failed_fasta_path, 'w') as f:
+        for job in failed_jobs:
+            for file_name in job.file_names:
+                print('   ', file_name, file=sys.stderr)
+                f.write('>{}\n{}\n'.format(file_name, job.seq))
+    print('Failed records written to', failed_fasta_path, file=sys.stderr)
+    return failed_names
+
+
+def copy_results(result_paths, out_dir, file_names):
+    """Copy results files written for file_names[0] to the other
+    file names in the list, keeping the format suffixes."""
+    src_prefix = os.path.join(out_dir, file_names[0])
+    for path in result_paths:
+        suffix = path[len(src_prefix):]
+        for file_name in file_names[1:]:
+            shutil.copyfile(path, os.path.join(out_dir, file_name+suffix))
 
 
 def run_from_command_line():
@@ -263,21 +662,90 @@ def run_from_command_line():
         Defaults to the first record.')
     parser.add_argument('-t', '--to', metavar="TO_RECORD", type = int,  help =
         "FastA record number to stop at. Useful for testing. Continues to end of FastA by default.")
+    parser.add_argument('-r', '--resume', action = 'store_true', help =
+        "Carry on from an interrupted run using the job manifest in OUT_DIR. Finished sequences are "
+        "skipped and running jobs are picked up again.")
+    parser.add_argument('--formats', help =
+        'Comma separated result types to download, e.g. xml,svg. All types are downloaded by default.')
+    parser.add_argument('--appl', help = 'Comma separated signature methods to use. Server default if not given.')
+    parser.add_argument('--goterms', action = 'store_true', default = None, help = 'Include GO terms.')
+    parser.add_argument('--pathways', action = 'store_true', default = None, help = 'Include pathway terms.')
+    parser.add_argument('-c', '--cache-dir', help =
+        'Directory to keep XML results in. Sequences already found there are not resubmitted.')
+    parser.add_argument('--cache-size', type = float, default = DEFAULT_MAX_BYTES/1024**2, metavar = 'MB', help =
+        'Maximum size of the cache in megabytes, least recently used results are removed. Default 1024.')
+    parser.add_argument('--metrics', metavar = 'FILE', help =
+        'Append request timings, job queue waits and run times to this JSON-lines file.')
+    parser.add_argument('--rate-limit', type = float, metavar = 'PER_SECOND', help =
+        'Maximum requests per second sent to the server. No limit by default.')
+    parser.add_argument('--retries', type = int, help =
+        'Times a failed status check or download is retried. Default 5.')
+    parser.add_argument('--precalc', metavar = 'URL_OR_PATH', help =
+        'Look up precalculated matches by sequence MD5 here first, only sequences not found are '
+        'submitted. A lookup service URL, a directory of <md5>.xml files or a multi-protein XML file.')
+    parser.add_argument('--local', metavar = 'INTERPROSCAN_SH', nargs = '?', const = 'interproscan.sh', help =
+        'Run a local InterProScan installation instead of using the REST service. Optionally give '
+        'the path of interproscan.sh.')
+    parser.add_argument('--batch-size', type = int, help =
+        'Sequences per run of the local interproscan.sh, default 100. Without --local, pack up to '
+        'this many sequences into each job, for servers that take multi-FASTA (not EBI).')
+    parser.add_argument('--batch-residues', type = int, help =
+        'Most residues in a --batch-size batch or a --local run.')
+    parser.add_argument('--local-processes', type = int, default = 1, help =
+        'Local interproscan.sh runs at once. Default 1.')
+    parser.add_argument('--local-args', help =
+        'Extra arguments for the local interproscan.sh, e.g. "-cpu 4 -dp".')
+    parser.add_argument('--baseURL', help =
+        'Base URL of the InterProScan REST service, e.g. a local mock_server.py. Defaults to EBI.')
+    parser.add_argument('--shard', metavar = 'I/N', help =
+        'Only run shard I of N (I from 1), split by sequence hash. Merge the shards\' out_dirs '
+        'afterwards with sharding.py.')
+    parser.add_argument('--queue', metavar = 'QUEUE_DIR', help =
+        'Take shards from a work queue in this directory on a shared filesystem until none are '
+        'left, see --shards. out_dir is where the worker finishing last merges them.')
+    parser.add_argument('--shards', type = int, default = 16, help =
+        'Number of shards in a new --queue. Default 16.')
+    parser.add_argument('--stale-after', type = float, default = 600, metavar = 'SECONDS', help =
+        'Take over --queue shards of workers that have been silent this long. Default 600.')
+    parser.add_argument('--lookahead', type = int, default = 100, help =
+        'Jobs prepared ahead of the ones being submitted. Default 100.')
 
 
 
     args = parser.parse_args()
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error('--rate-limit must be above 0, leave it out for no limit')
     # Check we have filenames
     assert args.use_fasta_descript or args.numbering
-    iprscan(
-        args.fasta_file,
-        args.out_dir,
-        args.email,
+    kwargs = dict(
         file_name_prefix = args.prefix,
         use_fasta_descriptions = args.use_fasta_descript,
         auto_numbering = args.numbering,
-        record_start_stop = (args.frm, args.to)
+        record_start_stop = (args.frm, args.to),
+        appl = args.appl,
+        goterms = args.goterms,
+        pathways = args.pathways,
+        cache_dir = args.cache_dir,
+        cache_max_bytes = int(args.cache_size*1024**2),
+        resume = args.resume,
+        results_formats = args.formats.split(',') if args.formats else None,
+        base_url = args.baseURL,
+        metrics_file = args.metrics,
+        rate_limit = args.rate_limit,
+        max_retries = args.retries,
+        precalc = args.precalc,
+        backend = LocalBackend(args.local, args.batch_size or 100, args.local_processes,
+                               args.local_args.split() if args.local_args else None,
+                               batch_residues = args.batch_residues) if args.local else None,
+        batch_records = None if args.local else args.batch_size,
+        batch_residues = None if args.local else args.batch_residues,
+        lookahead = args.lookahead,
     )
+    if args.queue:
+        iprscan_work_queue(args.fasta_file, args.out_dir, args.email, args.queue, args.shards,
+                           stale_after = args.stale_after, **kwargs)
+    else:
+        iprscan(args.fasta_file, args.out_dir, args.email, shard = args.shard, **kwargs)
 
 if __name__ == '__main__':
     print(sys.argv)
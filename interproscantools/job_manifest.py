@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, json, threading, time
+
+
+"""Crash safe record of the jobs iprscan() has sent, see JobManifest.__doc__"""
+
+MANIFEST_FILE_NAME = 'iprscan_manifest.jsonl'
+# Written to out_dir with the records that couldn't be scanned
+FAILED_FASTA_NAME = 'iprscan_failed.faa'
+
+# Job states
+SUBMITTED = 'SUBMITTED'
+FINISHED = 'FINISHED'
+FAILED = 'FAILED'
+
+
+class JobManifest(object):
+    """Append-only JSON-lines log of every job in an out_dir.
+
+    Each line records a state change for one unique sequence:
+        {"key": sequence hash, "state": SUBMITTED/FINISHED/FAILED,
+         "job_id": IPRScan job ID, "file_names": [...],
+         "outputs": [paths of results files], "time": unix time}
+    Lines are flushed and fsync'd as they're written so job IDs
+    survive a crash or reboot. The latest line for a key wins.
+
+    Args:
+    out_dir:
+        Results directory, the manifest is kept in there as
+        iprscan_manifest.jsonl
+    """
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, MANIFEST_FILE_NAME)
+        self._lock = threading.Lock()
+        self._checked_end = False
+
+    def load(self):
+        """Returns dict of key: latest entry."""
+        entries = {}
+        if not os.path.isfile(self.path):
+            return entries
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partially written line from a crash
+                    continue
+                entries[entry['key']] = entry
+        return entries
+
+    def record(self, key, state, job_id = None, file_names = (), outputs = ()):
+        entry = {'key':key, 'state':state, 'job_id':job_id,
+                 'file_names':list(file_names), 'outputs':list(outputs),
+                 'time':time.time()}
+        self._append(json.dumps(entry)+'\n')
+        return entry
+
+    def extend(self, entries):
+        """Append already made entries, e.g. from another manifest,
+        with a single fsync."""
+        self._append(''.join(json.dumps(entry)+'\n' for entry in entries))
+
+    def _append(self, lines):
+        with self._lock:
+            if not self._checked_end:
+                # A crash can leave half a line at the end, finish it off
+                # so the first new line isn't lost with it
+                if not self._ends_with_newline():
+                    lines = '\n' + lines
+                self._checked_end = True
+            with open(self.path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _ends_with_newline(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return True
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b'\n'
+        except FileNotFoundError:
+            return True
+
+
+def is_complete(entry):
+    """True if the entry is FINISHED and its results files still exist."""
+    return (entry is not None and entry['state'] == FINISHED and entry['outputs']
+            and all(os.path.isfile(p) for p in entry['outputs']))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, sys, time, heapq, itertools, collections, urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .metrics import registry as metrics_registry
+    from .file_utils import atomic_write
+    from .result_xml import split_xml_file
+except ImportError:
+    from metrics import registry as metrics_registry
+    from file_utils import atomic_write
+    from result_xml import split_xml_file
+
+
+"""Single loop that submits and polls IPRScan jobs, see JobScheduler.__doc__"""
+
+# Statuses meaning the job is still going
+RUNNING_STATUSES = ('RUNNING', 'PENDING', 'QUEUED')
+# Added to a job's out_path for its XML results
+XML_RESULT_SUFFIX = '.xml.xml'
+
+
+class Job(object):
+    """A unique sequence and the record file names it provides results for.
+    job_id is already set for jobs being resumed."""
+    __slots__ = ('key', 'seq', 'file_names', 'out_path', 'job_id', 'resumed',
+                 'queued_at', 'submitted_at', 'polls')
+
+    def __init__(self, key, seq, file_names, out_path, job_id = None):
+        self.key = key
+        self.seq = seq
+        self.file_names = file_names
+        self.out_path = out_path
+        self.job_id = job_id
+        self.resumed = job_id is not None
+        self.queued_at = time.time()
+        self.submitted_at = None
+        self.polls = 0
+
+
+class BatchJob(object):
+    """Several Jobs sent as one multi-FASTA submission, titled by their
+    keys. Has the attributes of a Job so the scheduler handles it the
+    same way, until the XML results are split up between the jobs."""
+    __slots__ = ('jobs', 'out_path', 'job_id', 'resumed', 'queued_at', 'submitted_at', 'polls')
+
+    def __init__(self, jobs, job_id = None):
+        self.jobs = jobs
+        # The combined results are downloaded next to the first job's, hidden
+        # so nothing mistakes them for a record's results
+        head, tail = os.path.split(jobs[0].out_path)
+        self.out_path = os.path.join(head, '.batch_' + tail)
+        self.job_id = job_id
+        self.resumed = job_id is not None
+        self.queued_at = min(job.queued_at for job in jobs)
+        self.submitted_at = None
+        self.polls = 0
+
+    @property
+    def seq(self):
+        return ''.join('>{}\n{}\n'.format(job.key, job.seq) for job in self.jobs)
+
+    @property
+    def file_names(self):
+        return [f for job in self.jobs for f in job.file_names]
+
+
+def pack_jobs(jobs, max_records = None, max_residues = None):
+    """Lists of jobs in the order they come, each up to max_records
+    jobs and max_residues residues, if they're given. A job longer than
+    max_residues goes on its own. Resumed jobs are only put with jobs
+    from the same submission (the same job_id), which come one after
+    another."""
+    batch, residues = [], 0
+    for job in jobs:
+        n = len(job.seq)
+        if batch and (job.job_id != batch[0].job_id or (max_records and len(batch) >= max_records)
+                      or (max_residues and residues + n > max_residues)):
+            yield batch
+            batch, residues = [], 0
+        batch.append(job)
+        residues += n
+    if batch:
+        yield batch
+
+
+def iter_batches(jobs, max_records = None, max_residues = None):
+    """BatchJobs of the jobs packed by pack_jobs."""
+    for batch in pack_jobs(jobs, max_records, max_residues):
+        yield BatchJob(batch, batch[0].job_id)
+
+
+def split_batch_results(xml_path, paths):
+    """Split a multi-protein XML results file between jobs, dict of
+    xref id (the job key used as the FASTA title) to the path its XML
+    is written to. Returns the keys that had results."""
+    paths = dict(paths)
+    done = []
+    for _, xref_ids, xml in split_xml_file(xml_path):
+        for xref_id in xref_ids:
+            if xref_id in paths:
+                atomic_write(paths.pop(xref_id), xml)
+                done.append(xref_id)
+                break
+    return done
+
+
+class JobScheduler(object):
+    """Runs IPRScan jobs from a single loop.
+
+    Up to max_concurrent_jobs are kept on the server. Every running job
+    has a next-poll time and the loop only asks for the status of jobs
+    that are due, so there are no per job sleeps. When a job finishes
+    its slot is refilled straight away and the results are downloaded
+    by a small pool of threads.
+
+    Poll intervals adapt to how long jobs are taking: once some jobs
+    have finished, a running job isn't polled again until it reaches the
+    lower quartile of observed durations. After that, or before there's
+    any history, the interval backs off exponentially from min_interval
+    to max_interval.
+
+    Args:
+    client:
+        IPRScan.IPRScanClient used for all requests.
+
+    email, params:
+        Passed to serviceRun for every job, params shouldn't include
+        the sequence.
+
+    max_concurrent_jobs (Default: 20):
+        Jobs on the server at once.
+
+    min_interval, max_interval (Default: 5, 60):
+        Bounds on the time between status checks of a job, seconds.
+
+    outformat (Default: None):
+        Result type, or list of types, to download. All of them if None.
+
+    on_submitted, on_finished, on_failed:
+        Optional callbacks, called as on_submitted(job),
+        on_finished(job, written_file_paths) and on_failed(job, exception).
+        on_finished is called from the download threads, if it raises
+        the job is passed to on_failed with the exception.
+
+    metrics (Default: None):
+        metrics.Metrics that gets each job's queue wait, run time and
+        fetch time, metrics.registry by default.
+
+    batch_records, batch_residues (Default: None, None):
+        Send up to batch_records jobs and batch_residues residues (either
+        or both) together as one multi-FASTA submission (a BatchJob).
+        Only for servers that take more than one sequence per job. Just
+        the XML is downloaded for a batch, and it's split up into each
+        job's out_path + '.xml.xml'. The callbacks still get each job.
+    """
+
+    backoff = 1.5
+    # Durations remembered for estimating how long jobs take
+    history_size = 100
+
+    def __init__(self, client, email, params = None, max_concurrent_jobs = 20,
+                 min_interval = 5, max_interval = 60, outformat = None,
+                 on_submitted = None, on_finished = None, on_failed = None,
+                 fetch_workers = 4, metrics = None, batch_records = None, batch_residues = None):
+        self.client = client
+        self.email = email
+        self.params = params or {}
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.outformat = outformat
+        self.on_submitted = on_submitted
+        self.on_finished = on_finished
+        self.on_failed = on_failed
+        self.fetch_workers = fetch_workers
+        self.durations = collections.deque(maxlen=self.history_size)
+        self.metrics = metrics_registry if metrics is None else metrics
+        self.batch_records = batch_records
+        self.batch_residues = batch_residues
+
+    def expected_duration(self):
+        """Lower quartile of recent job durations, None without history."""
+        if not self.durations:
+            return None
+        ordered = sorted(self.durations)
+        return ordered[len(ordered)//4]
+
+    def poll_interval(self, job, now):
+        age = now - job.submitted_at
+        expected = self.expected_duration()
+        if expected is not None and age < expected:
+            # Not likely to be done yet, check back when it might be
+            return min(self.max_interval, max(self.min_interval, expected - age))
+        return min(self.max_interval, self.min_interval * self.backoff**job.polls)
+
+    def _failed(self, job, ex):
+        print('Job for', job.file_names[0], 'failed:', repr(ex), file=sys.stderr)
+        for job in getattr(job, 'jobs', [job]):
+            self.metrics.incr('jobs.failed', job_id=job.job_id)
+            if self.on_failed:
+                self.on_failed(job, ex)
+
+    def _finished(self, job, written):
+        # Runs on a download thread whose future nobody looks at, so an
+        # error here has to become a failure or it'd be lost
+        self.metrics.incr('jobs.finished', job_id=job.job_id)
+        if self.on_finished:
+            try:
+                self.on_finished(job, written)
+            except Exception as ex:
+                self._failed(job, ex)
+
+    def _submit(self, job):
+        job.job_id = self.client.serviceRun(self.email, None, dict(self.params, sequence=job.seq))
+        job.resumed = False
+        job.polls = 0
+        job.submitted_at = time.time()
+        self.metrics.observe('job.queue_wait', job.submitted_at - job.queued_at, job_id=job.job_id)
+        self.metrics.incr('jobs.submitted', job_id=job.job_id)
+        print(job.job_id, job.file_names[0], file=sys.stderr)
+        for member in getattr(job, 'jobs', [job]):
+            member.job_id = job.job_id
+            if self.on_submitted:
+                self.on_submitted(member)
+
+    def _fetch(self, job):
+        if isinstance(job, BatchJob):
+            return self._fetch_batch(job)
+        try:
+            with self.metrics.timer('job.fetch', job_id=job.job_id):
+                written = self.client.fetchResults(job.job_id, job.out_path, self.outformat)
+        except Exception as ex:
+            self._failed(job, ex)
+            return
+        self._finished(job, written)
+
+    def _fetch_batch(self, batch):
+        paths = {job.key: job.out_path + XML_RESULT_SUFFIX for job in batch.jobs}
+        try:
+            with self.metrics.timer('job.fetch', job_id=batch.job_id, records=len(batch.jobs)):
+                written = self.client.fetchResults(batch.job_id, batch.out_path, 'xml')
+                try:
+                    done = set(split_batch_results(batch.out_path + XML_RESULT_SUFFIX, paths))
+                finally:
+                    for path in written:
+                        os.remove(path)
+        except Exception as ex:
+            self._failed(batch, ex)
+            return
+        for job in batch.jobs:
+            job.job_id = batch.job_id
+            if job.key in done:
+                self._finished(job, [paths[job.key]])
+            else:
+                self._failed(job, RuntimeError('no results for this sequence in the output of batch ' + batch.job_id))
+
+    def run(self, jobs):
+        """Run an iterable of Job, returns once they're all done."""
+        if self.batch_records or self.batch_residues:
+            jobs = iter_batches(jobs, self.batch_records, self.batch_residues)
+        jobs = iter(jobs)
+        # Resumed jobs the server didn't know about go back in the queue
+        retry = collections.deque()
+        # heap of (next poll time, tiebreak, job)
+        running = []
+        tiebreak = itertools.count()
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as fetchers:
+            while True:
+                # Fill free slots
+                while len(running) < self.max_concurrent_jobs:
+                    if retry:
+                        job = retry.popleft()
+                    else:
+                        job = next(jobs, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                    now = time.time()
+                    if job.job_id is None:
+                        try:
+                            self._submit(job)
+                        except Exception as ex:
+                            self._failed(job, ex)
+                            continue
+                        next_poll = now + self.poll_interval(job, now)
+                    else:
+                        # Resumed job, age unknown so check on it now
+                        job.submitted_at = now
+                        next_poll = now
+                    heapq.heappush(running, (next_poll, next(tiebreak), job))
+                    print('# jobs running:', len(running))
+                    self.metrics.gauge('jobs.running', len(running))
+
+                if not running:
+                    if exhausted and not retry:
+                        break
+                    continue
+
+                # Wait for the next job that's due
+                wait = running[0][0] - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                now = time.time()
+                n_running = len(running)
+                while running and running[0][0] <= now:
+                    _, _, job = heapq.heappop(running)
+                    try:
+                        status = self.client.serviceGetStatus(job.job_id)
+                    except urllib.error.HTTPError:
+                        status = 'ERROR'
+                    except Exception as ex:
+                        # Connection trouble, try again later
+                        print('Status check for', job.job_id, 'failed:', repr(ex), file=sys.stderr)
+                        status = 'RUNNING'
+                    job.polls += 1
+                    if status in RUNNING_STATUSES:
+                        heapq.heappush(running, (now + self.poll_interval(job, now),
+                                                 next(tiebreak), job))
+                    elif status == 'FINISHED':
+                        if not job.resumed:
+                            self.durations.append(now - job.submitted_at)
+                            self.metrics.observe('job.run_time', now - job.submitted_at, job_id=job.job_id)
+                        fetchers.submit(self._fetch, job)
+                    elif job.resumed:
+                        # Probably expired on the server, send it again
+                        print('Could not resume', job.job_id, 'for', job.file_names[0], file=sys.stderr)
+                        job.job_id = None
+                        job.queued_at = now
+                        retry.append(job)
+                    else:
+                        self._failed(job, RuntimeError('Job {} ended with status {}'.format(job.job_id, status)))
+                if len(running) != n_running:
+                    self.metrics.gauge('jobs.running', len(running))
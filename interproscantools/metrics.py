@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import time, json, bisect, threading, collections, contextlib
+
+
+"""Counters, latency histograms and listeners for tracing a run, see Metrics.__doc__"""
+
+# Upper bounds of the histogram buckets in seconds, 1 ms doubling up to ~17 minutes.
+# Anything slower goes in a final overflow bucket.
+BUCKET_BOUNDS = tuple(0.001 * 2**i for i in range(21))
+
+
+class Histogram(object):
+    """Counts of observed durations in BUCKET_BOUNDS buckets, with the
+    total, min and max."""
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+
+    def quantile(self, q):
+        """Estimate of the q quantile, interpolated within the bucket
+        it falls in."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, n in zip(BUCKET_BOUNDS + (self.max,), self.buckets):
+            if n and seen + n >= target:
+                value = lower + (upper - lower) * (target - seen) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+            lower = upper
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'total': self.total,
+                'mean': self.total/self.count if self.count else None,
+                'min': self.min, 'max': self.max,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class Metrics(object):
+    """Collects counters and latency histograms by name and passes each
+    measurement on to listeners as an event dict, e.g.
+        {'time': 1600000000.0, 'type': 'timing', 'name': 'iprscan.status',
+         'value': 0.21, 'error': False}
+    Other keyword arguments given with a measurement, like a job_id, are
+    added to its event. 'type' is 'count', 'timing' or 'gauge'.
+
+    IPRScan.IPRScanClient, the JobScheduler, the backends and
+    iter_IPRScan_xml_data all report to the module level `registry` by
+    default. iprscan() makes a new Metrics for each call, with
+    registry's listeners, and passes it to everything it uses. Names
+    used:
+        iprscan.submit, iprscan.status, iprscan.resulttypes, iprscan.result
+            timing of each request, and .errors counters for failures
+        job.queue_wait - time from a job being ready to being submitted
+        job.run_time - time from submission until it's seen to be finished
+        job.fetch - time to download a finished job's results
+        jobs.submitted, jobs.finished, jobs.failed - counters
+        jobs.running - gauge of jobs on the server
+        parse.file - time to parse each XML result file
+
+    Args:
+    metrics_file (Default: None):
+        Path of a JSON-lines file every event is appended to. A summary
+        event is written by close().
+    """
+
+    def __init__(self, metrics_file = None):
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self.gauges = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._file = None
+        if metrics_file:
+            self.open_file(metrics_file)
+
+    def add_listener(self, listener):
+        """listener(event) is called with every event, from whichever
+        thread made the measurement."""
+        self.listeners.append(listener)
+        return listener
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def open_file(self, path):
+        """Append events to a JSON-lines file."""
+        self.close_file()
+        self._file = open(path, 'a')
+
+    def close_file(self):
+        if self._file is not None:
+            self._write({'time': time.time(), 'type': 'summary', 'summary': self.summary()})
+            self._file.close()
+            self._file = None
+
+    close = close_file
+
+    def _write(self, event):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(event) + '\n')
+                self._file.flush()
+
+    def _emit(self, kind, name, value, fields):
+        # Nothing to do when nobody is listening
+        if not self.listeners and self._file is None:
+            return
+        event = {'time': time.time(), 'type': kind, 'name': name, 'value': value}
+        event.update(fields)
+        for listener in list(self.listeners):
+            listener(event)
+        self._write(event)
+
+    def incr(self, name, n = 1, **fields):
+        with self._lock:
+            self.counters[name] += n
+        self._emit('count', name, n, fields)
+
+    def observe(self, name, seconds, **fields):
+        with self._lock:
+            self.histograms[name].add(seconds)
+        self._emit('timing', name, seconds, fields)
+
+    def gauge(self, name, value, **fields):
+        with self._lock:
+            self.gauges[name] = value
+        self._emit('gauge', name, value, fields)
+
+    @contextlib.contextmanager
+    def timer(self, name, **fields):
+        """Time a block under name. If it raises, the timing has
+        error=True and name.errors is incremented."""
+        t = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - t, error=True, **fields)
+            self.incr(name + '.errors', **fields)
+            raise
+        self.observe(name, time.perf_counter() - t, error=False, **fields)
+
+    def summary(self):
+        """Dict of counters, gauges and histogram summaries."""
+        with self._lock:
+            return {'counters': dict(self.counters), 'gauges': dict(self.gauges),
+                    'timings': {name: h.summary() for name, h in self.histograms.items()}}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.gauges.clear()
+
+    def print_summary(self, file = None):
+        summary = self.summary()
+        for name, h in sorted(summary['timings'].items()):
+            print('%-22s n=%-7d mean %8.3f s  p50 %8.3f s  p90 %8.3f s  max %8.3f s' % (
+                name, h['count'], h['mean'], h['p50'], h['p90'], h['max']), file=file)
+        for name, n in sorted(summary['counters'].items()):
+            print('%-22s %d' % (name, n), file=file)
+
+
+# Shared by everything unless told otherwise
+registry = Metrics()
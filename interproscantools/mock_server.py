@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import sys, time, random, hashlib, itertools, threading, collections, argparse
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+"""Local stand-in for the InterProScan 5 REST service, see MockIPRScanServer.__doc__"""
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+DURATION_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential')
+
+XML_HEADER = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<protein-matches xmlns="http://www.ebi.ac.uk/interpro/resources/schemas/interproscan5"'
+              ' interproscan-version="5.48-83.0">\n')
+XML_FOOTER = '</protein-matches>\n'
+
+# identifier, label, fileSuffix, mediaType
+RESULT_TYPES = [('xml', 'XML', 'xml', 'application/xml'),
+                ('tsv', 'Tab Separated Values', 'tsv', 'text/tab-separated-values'),
+                ('sequence', 'Input Sequence', 'txt', 'text/plain')]
+
+
+def synthetic_protein_xml(seq, xref_id, matches_per_protein, rng):
+    """XML of one <protein> with matches_per_protein made up matches."""
+    seq_len = max(len(seq), 60)
+    parts = ['    <protein>\n'
+             '        <sequence md5="%s">%s</sequence>\n'
+             '        <xref id="%s" name="%s hypothetical protein"/>\n'
+             '        <matches>\n' % (hashlib.md5(seq.encode()).hexdigest(), seq, xref_id, xref_id)]
+    for m in range(matches_per_protein):
+        n = rng.randrange(5000)
+        start = rng.randrange(seq_len//2)
+        end = start + rng.randrange(20, seq_len//2)
+        parts.append(
+            '            <hmmer3-match evalue="1.2E-%d" score="%d.3">\n'
+            '                <signature ac="PF%05d" desc="Signature %d" name="Sig%d">\n'
+            '                    <entry ac="IPR%06d" desc="Entry %d description" name="Entry_%d" type="%s">\n'
+            '                        <go-xref category="MOLECULAR_FUNCTION" db="GO" id="GO:%07d" name="go term %d"/>\n'
+            '                        <go-xref category="BIOLOGICAL_PROCESS" db="GO" id="GO:%07d" name="go term %d"/>\n'
+            '                    </entry>\n'
+            '                    <signature-library-release library="PFAM" version="33.1"/>\n'
+            '                </signature>\n'
+            '                <locations>\n'
+            '                    <hmmer3-location env-end="%d" env-start="%d" score="%d.1" evalue="3.4E-9"'
+            ' hmm-start="1" hmm-end="%d" hmm-length="%d" hmm-bounds="COMPLETE" start="%d" end="%d">\n'
+            '                        <location-fragments>\n'
+            '                            <hmmer3-location-fragment start="%d" end="%d" dc-status="CONTINUOUS"/>\n'
+            '                        </location-fragments>\n'
+            '                    </hmmer3-location>\n'
+            '                </locations>\n'
+            '            </hmmer3-match>\n' % (
+                n%90, n, n, n, n, n, n, n, rng.choice(('DOMAIN', 'FAMILY', 'HOMOLOGOUS_SUPERFAMILY')),
+                n, n, n+1, n+1, end, start, n, end-start, end-start, start, end, start, end)
+        )
+    parts.append('        </matches>\n'
+                 '    </protein>\n')
+    return ''.join(parts)
+
+
+def synthetic_xml(proteins, matches_per_protein = 5):
+    """InterProScan 5 style XML for a list of (sequence, xref id). The
+    matches of each protein are seeded by its sequence so the same
+    sequence always gets the same results."""
+    parts = [XML_HEADER]
+    for seq, xref_id in proteins:
+        rng = random.Random(hashlib.md5(seq.encode()).digest())
+        parts.append(synthetic_protein_xml(seq, xref_id, matches_per_protein, rng))
+    parts.append(XML_FOOTER)
+    return ''.join(parts)
+
+
+def write_synthetic_xml(path, n_proteins, matches_per_protein, seq_len = 350, seed = 0):
+    """Write an InterProScan 5 style XML file with n_proteins random proteins."""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write(XML_HEADER)
+        for p in range(n_proteins):
+            seq = ''.join(rng.choice(AMINO_ACIDS) for _ in range(seq_len))
+            f.write(synthetic_protein_xml(seq, 'protein_%d' % p, matches_per_protein, rng))
+        f.write(XML_FOOTER)
+
+
+def parse_sequence_param(sequence):
+    """List of (sequence, id) from a submitted sequence, which can be
+    raw residues or FASTA with one or more records."""
+    sequence = sequence.strip()
+    if not sequence.startswith('>'):
+        return [(''.join(sequence.split()), 'sequence')]
+    records = []
+    for chunk in sequence[1:].split('\n>'):
+        header, _, body = chunk.partition('\n')
+        records.append((''.join(body.split()), (header.split() or ['sequence'])[0]))
+    return records
+
+
+class MockJob(object):
+    __slots__ = ('proteins', 'finish_at', 'fails')
+
+    def __init__(self, proteins, finish_at, fails):
+        self.proteins = proteins
+        self.finish_at = finish_at
+        self.fails = fails
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, without this Nagle and
+    # delayed ACKs add ~40 ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _send(self, code, body = '', content_type = 'text/plain'):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        # path after the base URL, e.g. ['status', 'job-1']
+        parts = [p for p in urllib.parse.urlparse(self.path).path.split('/') if p]
+        endpoint = parts[0] if parts else ''
+        server = self.server
+        server.count(endpoint)
+        # Always read the body so the connection can be reused
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.http_error_rate and server.random() < server.http_error_rate:
+            return self._send(503, 'Service temporarily unavailable')
+        if method == 'POST':
+            if endpoint != 'run':
+                return self._send(404, 'Not found')
+            form = urllib.parse.parse_qs(body.decode())
+            if not form.get('email') or not form.get('sequence'):
+                return self._send(400, 'email and sequence are required')
+            return self._send(200, server.submit(form['sequence'][0]))
+
+        if endpoint == 'precalc' and parts[1:] == ['matches']:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            md5s = ','.join(query.get('md5', [])).split(',')
+            return self._send(200, server.precalc_xml(md5s), 'application/xml')
+        if endpoint == 'parameters':
+            return self._send(200, '<parameters>' + ''.join(
+                '<id>%s</id>' % p for p in ('sequence', 'appl', 'goterms', 'pathways')
+            ) + '</parameters>', 'application/xml')
+        if len(parts) < 2:
+            return self._send(404, 'Not found')
+        job = server.jobs.get(parts[1])
+        if endpoint == 'status':
+            return self._send(200, server.status(job))
+        if job is None:
+            return self._send(404, 'Job not found')
+        if endpoint == 'resulttypes':
+            return self._send(200, '<types>' + ''.join(
+                '<type><identifier>%s</identifier><label>%s</label><fileSuffix>%s</fileSuffix>'
+                '<mediaType>%s</mediaType></type>' % t for t in RESULT_TYPES
+            ) + '</types>', 'application/xml')
+        if endpoint == 'result' and len(parts) == 3:
+            if server.status(job) != 'FINISHED':
+                return self._send(400, 'Job has not finished')
+            if parts[2] == 'xml':
+                return self._send(200, server.result_xml(job), 'application/xml')
+            if parts[2] == 'tsv':
+                return self._send(200, ''.join('%s\t%s\t%d\n' % (xref_id, hashlib.md5(seq.encode()).hexdigest(), len(seq))
+                                               for seq, xref_id in job.proteins))
+            if parts[2] == 'sequence':
+                return self._send(200, ''.join('>%s\n%s\n' % (xref_id, seq) for seq, xref_id in job.proteins))
+        return self._send(404, 'Not found')
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+
+class MockIPRScanServer(ThreadingHTTPServer):
+    """Local HTTP server that behaves enough like the EBI InterProScan 5
+    REST service (/run, /status, /resulttypes, /result and /parameters)
+    to run IPRScan.py and iprscan() against, e.g. for load testing.
+    Point them at it with the --baseURL option or IPRScan.baseUrl.
+
+    Args:
+    host, port (Default: '127.0.0.1', 0):
+        Address to listen on, port 0 picks a free one. See .url.
+
+    latency (Default: 0):
+        Seconds added to every response.
+
+    job_duration (Default: 1.0):
+        Mean time, in seconds, from submission until a job finishes.
+
+    duration_distribution (Default: 'exponential'):
+        'fixed', 'uniform' (0 to twice the mean) or 'exponential'.
+
+    failure_rate (Default: 0):
+        Fraction of jobs that end with status FAILURE.
+
+    http_error_rate (Default: 0):
+        Fraction of requests answered with a 503.
+
+    xml (Default: None):
+        Path of an XML file returned as the result of every job. Without
+        it made up results are generated from the submitted sequences,
+        with matches_per_protein matches each.
+
+    precalc (Default: None):
+        FASTA file of sequences that have precalculated matches. Any
+        sequence from a finished job is added to them. They're looked up
+        by MD5 at <url>/precalc/matches?md5=<md5>,<md5>,... which gives
+        generated results for the ones that are known, see
+        precalc.ServicePrecalcLookup.
+
+    seed (Default: None):
+        Seed for job durations, failures and errors.
+
+    The number of requests made to each endpoint is kept in
+    .request_counts.
+    """
+
+    def __init__(self, host = '127.0.0.1', port = 0, latency = 0, job_duration = 1.0,
+                 duration_distribution = 'exponential', failure_rate = 0, http_error_rate = 0,
+                 xml = None, matches_per_protein = 5, precalc = None, seed = None,
+                 verbose = False):
+        if duration_distribution not in DURATION_DISTRIBUTIONS:
+            raise ValueError('duration_distribution should be one of ' + ', '.join(DURATION_DISTRIBUTIONS))
+        ThreadingHTTPServer.__init__(self, (host, port), MockRequestHandler)
+        self.latency = latency
+        self.job_duration = job_duration
+        self.duration_distribution = duration_distribution
+        self.failure_rate = failure_rate
+        self.http_error_rate = http_error_rate
+        self.matches_per_protein = matches_per_protein
+        self.verbose = verbose
+        self.canned_xml = None
+        if xml is not None:
+            with open(xml, 'rb') as f:
+                self.canned_xml = f.read()
+        self.jobs = {}
+        # md5 of upper case sequence: (sequence, xref id)
+        self.precalculated = {}
+        if precalc is not None:
+            with open(precalc) as f:
+                for seq, xref_id in parse_sequence_param(f.read()):
+                    self.precalculated[hashlib.md5(seq.upper().encode()).hexdigest()] = (seq.upper(), xref_id)
+        self.request_counts = collections.Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._job_numbers = itertools.count(1)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.request_counts[endpoint] += 1
+
+    def _duration(self):
+        mean = self.job_duration
+        if self.duration_distribution == 'fixed':
+            return mean
+        if self.duration_distribution == 'uniform':
+            return self._rng.uniform(0, 2*mean)
+        return self._rng.expovariate(1/mean) if mean > 0 else 0
+
+    def submit(self, sequence):
+        with self._lock:
+            job_id = 'iprscan5-mock-%08d' % next(self._job_numbers)
+            self.jobs[job_id] = MockJob(parse_sequence_param(sequence),
+                                        time.time() + self._duration(),
+                                        self._rng.random() < self.failure_rate)
+        return job_id
+
+    def status(self, job):
+        if job is None:
+            return 'NOT_FOUND'
+        if time.time() < job.finish_at:
+            return 'RUNNING'
+        if job.fails:
+            return 'FAILURE'
+        for seq, xref_id in job.proteins:
+            self.precalculated.setdefault(hashlib.md5(seq.upper().encode()).hexdigest(), (seq.upper(), xref_id))
+        return 'FINISHED'
+
+    def precalc_xml(self, md5s):
+        known = [self.precalculated[md5] for md5 in md5s if md5 in self.precalculated]
+        return synthetic_xml(known, self.matches_per_protein)
+
+    def result_xml(self, job):
+        if self.canned_xml is not None:
+            return self.canned_xml
+        return synthetic_xml(job.proteins, self.matches_per_protein)
+
+    def start(self):
+        """Serve from a background thread, returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def run_from_command_line():
+    parser = argparse.ArgumentParser(
+        description= """Run a local mock of the InterProScan 5 REST service. Pass the
+        printed URL to iprscan_from_fasta.py or IPRScan.py with --baseURL.""",
+    )
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8000, help = 'Default 8000, 0 for any free port.')
+    parser.add_argument('--latency', type = float, default = 0, help = 'Seconds added to every response.')
+    parser.add_argument('--job-duration', type = float, default = 1.0, help = 'Mean job run time, seconds.')
+    parser.add_argument('--distribution', choices = DURATION_DISTRIBUTIONS, default = 'exponential',
+                        help = 'Distribution of job run times.')
+    parser.add_argument('--failure-rate', type = float, default = 0, help = 'Fraction of jobs that fail.')
+    parser.add_argument('--http-error-rate', type = float, default = 0,
+                        help = 'Fraction of requests answered with HTTP 503.')
+    parser.add_argument('--xml', help = 'XML file returned for every job instead of generated results.')
+    parser.add_argument('--matches', type = int, default = 5, help = 'Matches per protein in generated results.')
+    parser.add_argument('--precalc', metavar = 'FASTA', help = 'Sequences with precalculated matches.')
+    parser.add_argument('--seed', type = int)
+    parser.add_argument('-v', '--verbose', action = 'store_true', help = 'Log every request.')
+    args = parser.parse_args()
+
+    server = MockIPRScanServer(
+        args.host, args.port, latency = args.latency, job_duration = args.job_duration,
+        duration_distribution = args.distribution, failure_rate = args.failure_rate,
+        http_error_rate = args.http_error_rate, xml = args.xml,
+        matches_per_protein = args.matches, precalc = args.precalc, seed = args.seed,
+        verbose = args.verbose,
+    )
+    print('Mock InterProScan service at', server.url, file=sys.stderr)
+    print('Precalculated match lookup at', server.url + '/precalc', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(server.request_counts), file=sys.stderr)
+
+if __name__ == '__main__':
+    run_from_command_line()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, hashlib
+import urllib.error
+
+try:
+    from . import IPRScan
+    from .result_cache import normalise_sequence
+    from .result_xml import iter_protein_xml, split_xml_file
+except ImportError:
+    import IPRScan
+    from result_cache import normalise_sequence
+    from result_xml import iter_protein_xml, split_xml_file
+
+
+"""Look up precalculated InterProScan matches by sequence MD5, see PrecalcLookup.__doc__"""
+
+
+def sequence_md5(seq):
+    """Hex MD5 of the normalised sequence, as in the md5 attribute of
+    <sequence> in InterProScan XML."""
+    return hashlib.md5(normalise_sequence(seq).encode()).hexdigest()
+
+
+class PrecalcLookup(object):
+    """Source of already calculated InterProScan results, checked
+    before sequences are sent to be scanned.
+
+    Subclasses implement lookup(md5s), returning a dict of MD5 to the
+    XML (bytes) of a single protein InterProScan 5 document for the
+    MD5s that are known. lookup_all() calls it batch_size MD5s at a
+    time.
+    """
+    batch_size = 100
+
+    def lookup(self, md5s):
+        raise NotImplementedError
+
+    def lookup_all(self, md5s):
+        md5s = list(md5s)
+        hits = {}
+        for i in range(0, len(md5s), self.batch_size):
+            hits.update(self.lookup(md5s[i:i+self.batch_size]))
+        return hits
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalPrecalcLookup(PrecalcLookup):
+    """Precalculated results on disk. path is either a directory of
+    <md5>.xml files, one protein each, or an InterProScan XML file with
+    any number of proteins, e.g. the output of an earlier local run,
+    which is read into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.by_md5 = None
+        if not os.path.isdir(path):
+            self.by_md5 = {}
+            for md5, _, xml in split_xml_file(path):
+                if md5 is not None:
+                    self.by_md5.setdefault(md5, xml)
+
+    def lookup(self, md5s):
+        if self.by_md5 is not None:
+            return {md5: self.by_md5[md5] for md5 in md5s if md5 in self.by_md5}
+        hits = {}
+        for md5 in md5s:
+            try:
+                with open(os.path.join(self.path, md5 + '.xml'), 'rb') as f:
+                    hits[md5] = f.read()
+            except FileNotFoundError:
+                pass
+        return hits
+
+
+class ServicePrecalcLookup(PrecalcLookup):
+    """Precalculated results from a lookup service. GET
+    <url>/matches?md5=<md5>,<md5>,... should return an InterProScan 5
+    XML document holding the proteins that are known, as served by
+    mock_server.MockIPRScanServer at <server url>/precalc. Requests use
+    an IPRScan.IPRScanClient so they're pooled, rate limited and
+    retried in the same way as the scan requests, metrics is passed to
+    the client made if one isn't given."""
+
+    def __init__(self, url, client = None, metrics = None):
+        self.url = url.rstrip('/')
+        self.own_client = client is None
+        self.client = IPRScan.IPRScanClient(self.url, metrics = metrics) if client is None else client
+
+    def lookup(self, md5s):
+        if not md5s:
+            return {}
+        try:
+            data = self.client.restRequest(self.url + '/matches?md5=' + ','.join(md5s))
+        except urllib.error.HTTPError as ex:
+            if ex.code == 404:
+                return {}
+            raise
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        wanted = set(md5s)
+        hits = {}
+        for md5, _, xml in iter_protein_xml(data):
+            if md5 in wanted:
+                hits.setdefault(md5, xml)
+        return hits
+
+    def close(self):
+        if self.own_client:
+            self.client.close()
+
+
+def open_lookup(source, metrics = None):
+    """PrecalcLookup from a URL, a path or an existing PrecalcLookup."""
+    if isinstance(source, PrecalcLookup):
+        return source
+    if source.startswith(('http://', 'https://')):
+        return ServicePrecalcLookup(source, metrics = metrics)
+    return LocalPrecalcLookup(source)
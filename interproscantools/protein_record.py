@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import sys, math, array
+import xml.sax
+
+
+"""Compact per-file record of parsed IPRScan XML results, see ProteinRecord.__doc__"""
+
+# Entry, GO term and signature tuples are shared between every record
+# that has them, as there's only a few tens of thousands of each in
+# InterPro. Their strings are interned.
+_shared = {}
+
+
+def _share(*fields):
+    shared = _shared.get(fields)
+    if shared is None:
+        shared = tuple(sys.intern(f) if isinstance(f, str) else f for f in fields)
+        _shared[shared] = shared
+    return shared
+
+
+def _float(v, missing = math.nan):
+    # Scores and e-values, which some member databases don't give
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return missing
+
+
+class ProteinRecord(object):
+    """The results in one IPRScan XML file, kept compactly.
+
+    Unlike the deets dict it keeps the InterPro accessions, each
+    match's signature, member database, score and e-value, and where
+    each match is on the sequence. Entries, GO terms and signatures are
+    tuples shared by every record that has them, and the per match and
+    per location numbers are arrays, so a record costs a fraction of
+    the memory of a deets dict of sets.
+
+    Attributes:
+    filen, xref, md5, seq:
+        File name, the protein's xref id and MD5, and the sequence (None
+        if the file had no <sequence>).
+
+    entries:
+        Tuple of (ac, type, name, desc) InterPro entries, e.g.
+        ('IPR000001', 'DOMAIN', 'Kringle', 'Kringle').
+
+    go:
+        Tuple of (GO id, name, category).
+
+    signatures:
+        (ac, desc, library) of each match, e.g. ('PF00051', 'Kringle
+        domain', 'PFAM').
+
+    match_entry:
+        array of the index in entries of each match's entry, -1 for
+        matches without one.
+
+    scores, evalues:
+        arrays of each match's score and e-value, nan if not given.
+
+    loc_match, starts, ends:
+        arrays of the match index, start and end of each location.
+        matches() puts these together.
+
+    Files holding more than one protein give one record with all of
+    their matches, as IprHandler_v2 does, with the xref, md5 and seq of
+    the last protein.
+    """
+    __slots__ = ('filen', 'xref', 'md5', 'seq', 'entries', 'go', 'signatures',
+                 'match_entry', 'scores', 'evalues', 'loc_match', 'starts', 'ends')
+
+    def __init__(self, filen = None):
+        self.filen = filen
+        self.xref = None
+        self.md5 = None
+        self.seq = None
+        self.entries = ()
+        self.go = ()
+        self.signatures = ()
+        self.match_entry = array.array('i')
+        self.scores = array.array('d')
+        self.evalues = array.array('d')
+        self.loc_match = array.array('I')
+        self.starts = array.array('I')
+        self.ends = array.array('I')
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+        # Share again after being sent from another process
+        self.entries = tuple(_share(*e) for e in self.entries)
+        self.go = tuple(_share(*g) for g in self.go)
+        self.signatures = tuple(_share(*s) for s in self.signatures)
+
+    def __eq__(self, other):
+        return isinstance(other, ProteinRecord) and self.__getstate__() == other.__getstate__()
+
+    def __repr__(self):
+        return '<ProteinRecord {} {} matches>'.format(self.filen, len(self.signatures))
+
+    @property
+    def accessions(self):
+        return [e[0] for e in self.entries]
+
+    @property
+    def domains(self):
+        return [e[3] for e in self.entries if e[1] == 'DOMAIN']
+
+    @property
+    def families(self):
+        return [e[3] for e in self.entries if e[1] == 'FAMILY']
+
+    def matches(self):
+        """Yields (signature ac, library, entry ac or None, start, end,
+        score, evalue) for every location of every match."""
+        for m, start, end in zip(self.loc_match, self.starts, self.ends):
+            e = self.match_entry[m]
+            yield (self.signatures[m][0], self.signatures[m][2],
+                   self.entries[e][0] if e >= 0 else None,
+                   start, end, self.scores[m], self.evalues[m])
+
+    def to_deets(self):
+        """The dict get_IPRScan_xml_data gives for this file."""
+        return {'go num':{g[0] for g in self.go}, 'go term':{g[1] for g in self.go},
+                'dom':set(self.domains), 'fam':set(self.families),
+                'seq':[self.seq] if self.seq is not None else '', 'filen':self.filen}
+
+
+class MatchWalker(xml.sax.ContentHandler):
+    # Walks the proteins and matches of an InterProScan 5 XML file,
+    # calling the methods below, which do nothing here. Subclasses
+    # override the ones they need. Entries and GO terms are given as
+    # shared tuples (see _share), (ac, type, name, desc) and (id, name,
+    # category), and scores and e-values as the attribute strings or
+    # None. self.in_match is True between start_match and end_match.
+    def __init__(self):
+        xml.sax.ContentHandler.__init__(self)
+        self.in_match = False
+        self.in_seq = False
+        self.seq_chunks = []
+
+    def start_protein(self): pass
+    def end_protein(self): pass
+    def protein_xref(self, xref): pass
+    def protein_md5(self, md5): pass
+    def protein_seq(self, seq): pass
+    def start_match(self, score, evalue): pass
+    def end_match(self): pass
+    def signature(self, ac, desc): pass
+    def signature_library(self, library): pass
+    def entry(self, entry): pass
+    def go_xref(self, go): pass
+    def location(self, start, end): pass
+
+    def startElement(self, name, attrs):
+        # Most common elements first
+        if name == 'go-xref':
+            self.go_xref(_share(attrs['id'], attrs.get('name'), attrs.get('category')))
+        elif name == 'entry':
+            self.entry(_share(attrs['ac'], attrs.get('type'), attrs.get('name'), attrs.get('desc')))
+        elif not self.in_match:
+            if name == 'sequence':
+                self.in_seq = True
+                self.seq_chunks = []
+                self.protein_md5(attrs.get('md5'))
+            elif name == 'xref':
+                self.protein_xref(attrs.get('id'))
+            elif name == 'protein':
+                self.start_protein()
+            elif name.endswith('-match'):
+                self.in_match = True
+                self.start_match(attrs.get('score'), attrs.get('evalue'))
+        elif name == 'signature':
+            self.signature(attrs.get('ac'), attrs.get('desc'))
+        elif name == 'signature-library-release':
+            self.signature_library(attrs.get('library'))
+        elif name.endswith('-location') and 'start' in attrs:
+            self.location(int(attrs['start']), int(attrs['end']))
+
+    def endElement(self, name):
+        if name == 'sequence':
+            self.in_seq = False
+            self.protein_seq(''.join(self.seq_chunks))
+            self.seq_chunks = []
+        elif self.in_match:
+            if name.endswith('-match'):
+                self.in_match = False
+                self.end_match()
+        elif name == 'protein':
+            self.end_protein()
+
+    def characters(self, content):
+        if self.in_seq:
+            self.seq_chunks.append(content)
+
+
+class ProteinRecordHandler(MatchWalker):
+    # Builds a ProteinRecord, self.record, from an InterProScan 5 XML file.
+    # Entries and GO terms are kept in dicts while parsing for their order
+    # and to drop repeats, and turned into tuples at the end.
+    def __init__(self, filen = None):
+        MatchWalker.__init__(self)
+        self.record = ProteinRecord(filen)
+        self.entries = {}
+        self.go = {}
+        self.signatures = []
+
+    def protein_xref(self, xref):
+        self.record.xref = xref
+
+    def protein_md5(self, md5):
+        self.record.md5 = md5
+
+    def protein_seq(self, seq):
+        self.record.seq = seq
+
+    def start_match(self, score, evalue):
+        record = self.record
+        self.signatures.append([None, None, None])
+        record.match_entry.append(-1)
+        record.scores.append(_float(score))
+        record.evalues.append(_float(evalue))
+
+    def signature(self, ac, desc):
+        self.signatures[-1][:2] = ac, desc
+
+    def signature_library(self, library):
+        self.signatures[-1][2] = library
+
+    def entry(self, entry):
+        i = self.entries.setdefault(entry, len(self.entries))
+        if self.in_match:
+            self.record.match_entry[-1] = i
+
+    def go_xref(self, go):
+        self.go.setdefault(go)
+
+    def location(self, start, end):
+        record = self.record
+        record.loc_match.append(len(self.signatures)-1)
+        record.starts.append(start)
+        record.ends.append(end)
+
+    def endDocument(self):
+        record = self.record
+        record.entries = tuple(self.entries)
+        record.go = tuple(self.go)
+        record.signatures = tuple(_share(*s) for s in self.signatures)
+
+
+def parse_xml_record(path, filen = None):
+    """ProteinRecord of an IPRScan XML file, filen defaults to path."""
+    handler = ProteinRecordHandler(path if filen is None else filen)
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    with open(path, 'rb') as f:
+        parser.parse(f)
+    return handler.record
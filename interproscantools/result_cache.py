@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, hashlib, json, threading
+
+try:
+    from .file_utils import atomic_copy
+except ImportError:
+    from file_utils import atomic_copy
+
+
+"""Local on-disk cache of IPRScan XML results, see ResultCache.__doc__"""
+
+# Default size cap, 1 GB
+DEFAULT_MAX_BYTES = 1024**3
+
+
+def normalise_sequence(seq):
+    """Upper case amino acid sequence with whitespace and any
+    trailing stop '*' removed."""
+    return ''.join(str(seq).split()).upper().rstrip('*')
+
+
+def sequence_key(seq, appl = None, goterms = None, pathways = None):
+    """Hex digest identifying a sequence and the options that change
+    what IPRScan returns for it."""
+    if appl and not isinstance(appl, str):
+        appl = ','.join(sorted(appl))
+    opts = json.dumps([appl or None, goterms, pathways])
+    h = hashlib.sha256(normalise_sequence(seq).encode())
+    h.update(opts.encode())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """Content addressed store of IPRScan XML results.
+
+    Results are keyed by a hash of the normalised sequence plus the
+    options that change what IPRScan returns (appl, goterms, pathways)
+    so the same protein is only ever sent to EBI once.
+
+    Args:
+    cache_dir:
+        Directory holding the cache, created if it doesn't exist. Can
+        be shared between runs and between output directories.
+
+    max_bytes (Default: 1 GB):
+        Size cap. When exceeded the least recently used results are
+        deleted until the cache is back under 90% of the cap. Reads
+        update a result's mtime so that's used to judge recent use.
+    """
+
+    def __init__(self, cache_dir, max_bytes = DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    make_key = staticmethod(sequence_key)
+
+    def path(self, key):
+        # Split over subdirectories so no single dir gets huge
+        return os.path.join(self.cache_dir, key[:2], key+'.xml')
+
+    def _entries(self):
+        """(path, size, mtime) of every cached result."""
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                if f.name.endswith('.xml'):
+                    st = f.stat()
+                    yield f.path, st.st_size, st.st_mtime
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key, dest_path):
+        """Copy the cached result for key to dest_path. Returns True
+        on a hit, False if key isn't cached."""
+        src = self.path(key)
+        try:
+            os.utime(src)
+        except FileNotFoundError:
+            return False
+        atomic_copy(src, dest_path)
+        return True
+
+    def put(self, key, src_path):
+        """Store a copy of the XML results file at src_path under key."""
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        atomic_copy(src_path, dest)
+        with self._lock:
+            self._size += os.path.getsize(dest)
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def evict(self, target_bytes = None):
+        """Delete least recently used results until the cache is
+        smaller than target_bytes (default 90% of max_bytes)."""
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes*0.9)
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        size = sum(e[1] for e in entries)
+        for path, fsize, _ in entries:
+            if size <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= fsize
+        self._size = size
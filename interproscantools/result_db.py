@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, sys, sqlite3, argparse, multiprocessing
+import xml.sax
+
+try:
+    from .protein_record import MatchWalker, _float
+    from .file_utils import is_results_file
+except ImportError:
+    from protein_record import MatchWalker, _float
+    from file_utils import is_results_file
+
+
+"""Load IPRScan XML results into a queryable SQLite database, see ResultDB.__doc__"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS proteins (
+    id INTEGER PRIMARY KEY,
+    filen TEXT NOT NULL,
+    xref TEXT,
+    md5 TEXT,
+    seq TEXT
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    ac TEXT UNIQUE NOT NULL,
+    type TEXT,
+    name TEXT,
+    desc TEXT
+);
+CREATE TABLE IF NOT EXISTS go_terms (
+    id INTEGER PRIMARY KEY,
+    go_id TEXT UNIQUE NOT NULL,
+    name TEXT,
+    category TEXT
+);
+CREATE TABLE IF NOT EXISTS entry_go (
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    go_term_id INTEGER NOT NULL REFERENCES go_terms(id),
+    PRIMARY KEY (entry_id, go_term_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS protein_go (
+    protein_id INTEGER NOT NULL REFERENCES proteins(id),
+    go_term_id INTEGER NOT NULL REFERENCES go_terms(id),
+    PRIMARY KEY (protein_id, go_term_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    protein_id INTEGER NOT NULL REFERENCES proteins(id),
+    entry_id INTEGER REFERENCES entries(id),
+    signature_ac TEXT,
+    signature_desc TEXT,
+    library TEXT,
+    start INTEGER,
+    end INTEGER,
+    score REAL,
+    evalue REAL
+);
+CREATE INDEX IF NOT EXISTS proteins_filen ON proteins(filen);
+CREATE INDEX IF NOT EXISTS proteins_md5 ON proteins(md5);
+CREATE INDEX IF NOT EXISTS entries_desc ON entries(desc);
+CREATE INDEX IF NOT EXISTS go_terms_name ON go_terms(name);
+CREATE INDEX IF NOT EXISTS protein_go_term ON protein_go(go_term_id);
+CREATE INDEX IF NOT EXISTS matches_protein ON matches(protein_id);
+CREATE INDEX IF NOT EXISTS matches_entry ON matches(entry_id);
+CREATE INDEX IF NOT EXISTS matches_signature ON matches(signature_ac);
+"""
+
+
+class IprMatchHandler(MatchWalker):
+    # Keeps each <protein> separately with its matches. self.proteins is
+    # a list of dicts:
+    #   {'xref', 'md5', 'seq', 'matches':[match, ...]}
+    # where each match is a dict with the signature, entry (or None),
+    # GO xrefs and a list of (start, end) locations.
+    def __init__(self):
+        MatchWalker.__init__(self)
+        self.proteins = []
+        self.protein = None
+        self.match = None
+
+    def start_protein(self):
+        self.protein = {'xref':None, 'md5':None, 'seq':'', 'matches':[]}
+
+    def end_protein(self):
+        self.proteins.append(self.protein)
+        self.protein = None
+
+    def protein_xref(self, xref):
+        if self.protein is not None and self.protein['xref'] is None:
+            self.protein['xref'] = xref
+
+    def protein_md5(self, md5):
+        if self.protein is not None:
+            self.protein['md5'] = md5
+
+    def protein_seq(self, seq):
+        if self.protein is not None:
+            self.protein['seq'] = seq
+
+    def start_match(self, score, evalue):
+        if self.protein is not None:
+            # NULL in the database when not given
+            self.match = {'score':_float(score, None), 'evalue':_float(evalue, None),
+                          'signature_ac':None, 'signature_desc':None, 'library':None,
+                          'entry':None, 'go':[], 'locations':[]}
+
+    def end_match(self):
+        if self.match is not None:
+            self.protein['matches'].append(self.match)
+            self.match = None
+
+    def signature(self, ac, desc):
+        if self.match is not None:
+            self.match['signature_ac'] = ac
+            self.match['signature_desc'] = desc
+
+    def signature_library(self, library):
+        if self.match is not None:
+            self.match['library'] = library
+
+    def entry(self, entry):
+        if self.match is not None:
+            self.match['entry'] = entry
+
+    def go_xref(self, go):
+        if self.match is not None:
+            self.match['go'].append(go)
+
+    def location(self, start, end):
+        if self.match is not None:
+            self.match['locations'].append((start, end))
+
+
+def parse_xml_proteins(path):
+    """List of protein dicts from IprMatchHandler for one XML file."""
+    parser = xml.sax.make_parser()
+    handler = IprMatchHandler()
+    parser.setContentHandler(handler)
+    with open(path, 'rb') as f:
+        parser.parse(f)
+    return handler.proteins
+
+
+def _parse_named_xml_proteins(args):
+    dirname, xmlfile = args
+    return xmlfile, parse_xml_proteins(os.path.join(dirname, xmlfile))
+
+
+class ResultDB(object):
+    """Normalised, indexed SQLite store of IPRScan results.
+
+    Tables:
+        proteins - one row per <protein> (filen, xref id, md5, sequence)
+        entries - InterPro entries by accession (type DOMAIN/FAMILY/...)
+        go_terms - GO terms by id
+        entry_go - GO terms of each entry
+        protein_go - GO terms of each protein
+        matches - every signature match location on a protein with its
+            entry, library, start, end, score and evalue
+
+    Args:
+    db_path:
+        SQLite file, created if it doesn't exist.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        self._entry_ids = dict(self.db.execute('SELECT ac, id FROM entries'))
+        self._go_ids = dict(self.db.execute('SELECT go_id, id FROM go_terms'))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _entry_id(self, entry):
+        ac = entry[0]
+        entry_id = self._entry_ids.get(ac)
+        if entry_id is None:
+            entry_id = self.db.execute('INSERT INTO entries (ac, type, name, desc) VALUES (?, ?, ?, ?)',
+                                       entry).lastrowid
+            self._entry_ids[ac] = entry_id
+        return entry_id
+
+    def _go_id(self, go):
+        go_id = self._go_ids.get(go[0])
+        if go_id is None:
+            go_id = self.db.execute('INSERT INTO go_terms (go_id, name, category) VALUES (?, ?, ?)',
+                                    go).lastrowid
+            self._go_ids[go[0]] = go_id
+        return go_id
+
+    def remove_file(self, filen):
+        """Delete the proteins, and their matches, loaded from filen."""
+        ids = [(i,) for i, in self.db.execute('SELECT id FROM proteins WHERE filen=?', (filen,))]
+        self.db.executemany('DELETE FROM matches WHERE protein_id=?', ids)
+        self.db.executemany('DELETE FROM protein_go WHERE protein_id=?', ids)
+        self.db.executemany('DELETE FROM proteins WHERE id=?', ids)
+
+    def add_file(self, filen, proteins):
+        """Load the proteins parsed from an XML file, replacing any
+        already loaded from a file of that name."""
+        self.remove_file(filen)
+        for protein in proteins:
+            protein_id = self.db.execute(
+                'INSERT INTO proteins (filen, xref, md5, seq) VALUES (?, ?, ?, ?)',
+                (filen, protein['xref'], protein['md5'], protein['seq'])).lastrowid
+            match_rows = []
+            go_ids = set()
+            for match in protein['matches']:
+                entry_id = None
+                if match['entry'] is not None:
+                    entry_id = self._entry_id(match['entry'])
+                    for go in match['go']:
+                        go_id = self._go_id(go)
+                        go_ids.add(go_id)
+                        self.db.execute('INSERT OR IGNORE INTO entry_go VALUES (?, ?)', (entry_id, go_id))
+                locations = match['locations'] or [(None, None)]
+                for start, end in locations:
+                    match_rows.append((protein_id, entry_id, match['signature_ac'], match['signature_desc'],
+                                       match['library'], start, end, match['score'], match['evalue']))
+            self.db.executemany(
+                'INSERT INTO matches (protein_id, entry_id, signature_ac, signature_desc, library, '
+                'start, end, score, evalue) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', match_rows)
+            self.db.executemany('INSERT INTO protein_go VALUES (?, ?)',
+                                ((protein_id, go_id) for go_id in go_ids))
+
+    def ingest(self, dirname, processes = 1, chunksize = 32):
+        """Parse every XML file in dirname and load it. Files already
+        loaded are replaced. Returns the number of files loaded."""
+        dirname = os.path.abspath(dirname)
+        xml_files = [f for f in os.listdir(dirname) if is_results_file(f)]
+        # Data can always be re-ingested, so don't wait on the disk
+        self.db.execute('PRAGMA synchronous=OFF')
+        with self.db:
+            if processes == 1:
+                for xmlfile in xml_files:
+                    self.add_file(xmlfile, parse_xml_proteins(os.path.join(dirname, xmlfile)))
+            else:
+                with multiprocessing.Pool(processes) as pool:
+                    tasks = ((dirname, f) for f in xml_files)
+                    for xmlfile, proteins in pool.imap_unordered(_parse_named_xml_proteins, tasks, chunksize):
+                        self.add_file(xmlfile, proteins)
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('ANALYZE')
+        return len(xml_files)
+
+    # Queries
+    def proteins_with_term(self, term):
+        """File names of proteins with a GO term (by 'GO:...' id or name)
+        or an InterPro entry (by 'IPR...' accession or description)."""
+        if term.startswith('GO:'):
+            sql = ('SELECT DISTINCT p.filen FROM go_terms g JOIN protein_go pg ON pg.go_term_id=g.id '
+                   'JOIN proteins p ON p.id=pg.protein_id WHERE g.go_id=?')
+        elif term.startswith('IPR'):
+            sql = ('SELECT DISTINCT p.filen FROM entries e JOIN matches m ON m.entry_id=e.id '
+                   'JOIN proteins p ON p.id=m.protein_id WHERE e.ac=?')
+        else:
+            sql = ('SELECT p.filen FROM go_terms g JOIN protein_go pg ON pg.go_term_id=g.id '
+                   'JOIN proteins p ON p.id=pg.protein_id WHERE g.name=? '
+                   'UNION SELECT p.filen FROM entries e JOIN matches m ON m.entry_id=e.id '
+                   'JOIN proteins p ON p.id=m.protein_id WHERE e.desc=?')
+            return [f for f, in self.db.execute(sql, (term, term))]
+        return [f for f, in self.db.execute(sql, (term,))]
+
+    def terms_for_protein(self, filen):
+        """Dict of the GO terms, domains and families of the protein(s)
+        in filen. Each is a sorted list of (id/accession, name) tuples."""
+        go = self.db.execute(
+            'SELECT DISTINCT g.go_id, g.name FROM proteins p JOIN protein_go pg ON pg.protein_id=p.id '
+            'JOIN go_terms g ON g.id=pg.go_term_id WHERE p.filen=? ORDER BY g.go_id', (filen,)).fetchall()
+        entries = self.db.execute(
+            'SELECT DISTINCT e.ac, e.desc, e.type FROM proteins p JOIN matches m ON m.protein_id=p.id '
+            'JOIN entries e ON e.id=m.entry_id WHERE p.filen=? ORDER BY e.ac', (filen,)).fetchall()
+        return {'go':go,
+                'dom':[(ac, desc) for ac, desc, t in entries if t == 'DOMAIN'],
+                'fam':[(ac, desc) for ac, desc, t in entries if t == 'FAMILY'],
+                'entries':[(ac, desc) for ac, desc, t in entries]}
+
+    def matches_for_protein(self, filen):
+        """(signature ac, library, entry ac, start, end, score, evalue)
+        of every match location in filen, ordered by start."""
+        return self.db.execute(
+            'SELECT m.signature_ac, m.library, e.ac, m.start, m.end, m.score, m.evalue '
+            'FROM proteins p JOIN matches m ON m.protein_id=p.id LEFT JOIN entries e ON e.id=m.entry_id '
+            'WHERE p.filen=? ORDER BY m.start', (filen,)).fetchall()
+
+
+def run_from_command_line():
+    parser = argparse.ArgumentParser(
+        description= """Load a directory of InterProScan XML results into a SQLite database
+        and look up which proteins carry a GO term or InterPro entry.""",
+    )
+    parser.add_argument('db_file', help = 'SQLite database, created if needed.')
+    parser.add_argument('-d', '--dir-name', help = 'Directory of IPRScan XML results to load.')
+    parser.add_argument('-j', '--processes', type = int, default = 1,
+                        help = 'Parse XML files in this many processes at once. 0 to use all CPUs.')
+    parser.add_argument('-t', '--term', help = 'Print proteins with this GO id/name or InterPro accession/description.')
+    parser.add_argument('-p', '--protein', help = 'Print the GO terms and InterPro entries of this results file.')
+    args = parser.parse_args()
+    with ResultDB(args.db_file) as db:
+        if args.dir_name:
+            n = db.ingest(args.dir_name, args.processes or None)
+            print('Loaded', n, 'files.', file=sys.stderr)
+        if args.term:
+            for filen in db.proteins_with_term(args.term):
+                print(filen)
+        if args.protein:
+            for kind, terms in db.terms_for_protein(args.protein).items():
+                if kind == 'entries':
+                    continue
+                for ac, name in terms:
+                    print(kind, ac, name, sep='\t')
+
+if __name__ == '__main__':
+    run_from_command_line()
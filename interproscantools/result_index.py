@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, json, hashlib, sqlite3, multiprocessing
+
+try:
+    from .tabulate_iprs_results import parse_xml_file, record_to_deets, _parse_named_xml_file
+    from .file_utils import is_results_file
+except ImportError:
+    from tabulate_iprs_results import parse_xml_file, record_to_deets, _parse_named_xml_file
+    from file_utils import is_results_file
+
+
+"""Sidecar index of already parsed XML results, see ResultIndex.__doc__"""
+
+INDEX_FILE_NAME = 'iprscan_index.sqlite'
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultIndex(object):
+    """SQLite file kept in a results directory that stores the record
+    extracted from each XML file, keyed by file name and checked
+    against the file's mtime, size and content hash.
+
+    update() only parses files that are new or have changed since the
+    last run and drops records of files that have been deleted, then
+    iter_deets() gives the results without touching the XML.
+
+    Args:
+    dirname:
+        Directory of IPRScan XML results.
+
+    index_path (Default: None):
+        Where to keep the index, dirname/iprscan_index.sqlite by default.
+    """
+
+    def __init__(self, dirname, index_path = None):
+        self.dirname = os.path.abspath(dirname)
+        self.index_path = index_path or os.path.join(self.dirname, INDEX_FILE_NAME)
+        self.db = sqlite3.connect(self.index_path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'filen TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, '
+                        'sha1 TEXT, record TEXT)')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, processes = 1, chunksize = 32):
+        """Bring the index up to date with the directory. Returns
+        (files parsed, records removed)."""
+        known = {filen:(mtime_ns, size, sha1) for filen, mtime_ns, size, sha1
+                 in self.db.execute('SELECT filen, mtime_ns, size, sha1 FROM files')}
+        present = set()
+        to_parse = []
+        with self.db:
+            for entry in os.scandir(self.dirname):
+                if not is_results_file(entry.name):
+                    continue
+                present.add(entry.name)
+                st = entry.stat()
+                old = known.get(entry.name)
+                if old and old[:2] == (st.st_mtime_ns, st.st_size):
+                    continue
+                sha1 = file_hash(entry.path)
+                if old and old[2] == sha1:
+                    # Touched but not changed
+                    self.db.execute('UPDATE files SET mtime_ns=?, size=? WHERE filen=?',
+                                    (st.st_mtime_ns, st.st_size, entry.name))
+                else:
+                    to_parse.append((entry.name, st.st_mtime_ns, st.st_size, sha1))
+
+            removed = [f for f in known if f not in present]
+            self.db.executemany('DELETE FROM files WHERE filen=?', ((f,) for f in removed))
+
+        stats = {filen:(mtime_ns, size, sha1) for filen, mtime_ns, size, sha1 in to_parse}
+        if processes == 1 or len(to_parse) <= chunksize:
+            parsed = ((filen, parse_xml_file(os.path.join(self.dirname, filen)))
+                      for filen in stats)
+            self._store(parsed, stats)
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                tasks = ((self.dirname, filen) for filen in stats)
+                self._store(pool.imap_unordered(_parse_named_xml_file, tasks, chunksize), stats)
+
+        return len(to_parse), len(removed)
+
+    def _store(self, parsed, stats):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                ((filen,)+stats[filen]+(json.dumps(record),) for filen, record in parsed)
+            )
+
+    def iter_deets(self):
+        """Yields the deets dict of every indexed file, as from
+        iter_IPRScan_xml_data, in file name order."""
+        for filen, record in self.db.execute('SELECT filen, record FROM files ORDER BY filen'):
+            yield record_to_deets(filen, json.loads(record))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import re
+
+
+"""Split multi-protein InterProScan XML into single protein documents, see iter_protein_xml.__doc__"""
+
+# <protein> elements are siblings directly under <protein-matches>
+PROTEIN_RE = re.compile(rb'<protein[\s>].*?</protein>', re.DOTALL)
+MD5_RE = re.compile(rb'<sequence[^>]*\smd5="([0-9a-fA-F]+)"')
+XREF_RE = re.compile(rb'<xref[^>]*\sid="([^"]*)"')
+
+
+def iter_protein_xml(data):
+    """Yields (md5, [xref ids], xml) for every <protein> in an XML
+    document (bytes), where xml is a complete document holding just
+    that protein, with the original declaration and root element. The
+    text is split as is, without being parsed and written out again."""
+    first = None
+    last_end = None
+    proteins = []
+    for m in PROTEIN_RE.finditer(data):
+        if first is None:
+            first = m.start()
+        last_end = m.end()
+        proteins.append(m.group())
+    if first is None:
+        return
+    # Keep the indentation of the first <protein>
+    header = data[:first]
+    footer = data[last_end:]
+    for protein in proteins:
+        md5 = MD5_RE.search(protein)
+        yield (md5.group(1).decode().lower() if md5 else None,
+               [x.decode() for x in XREF_RE.findall(protein)],
+               header + protein + footer)
+
+
+def split_xml_file(path):
+    """iter_protein_xml for a file, returns a list."""
+    with open(path, 'rb') as f:
+        return list(iter_protein_xml(f.read()))
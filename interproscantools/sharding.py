@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, sys, json, time, shutil, socket, argparse, threading
+
+try:
+    from . import job_manifest
+except ImportError:
+    import job_manifest
+
+
+"""Split one FASTA's jobs between machines and merge their results, see
+shard_index.__doc__, WorkQueue.__doc__ and merge_shards.__doc__"""
+
+# Written to a WorkQueue directory
+QUEUE_FILE_NAME = 'queue.json'
+MERGE_LOCK_NAME = 'merge.lock'
+
+
+def parse_shard(shard):
+    """(i, n) from 'i/n' or an (i, n) tuple, where i counts from 1."""
+    if isinstance(shard, str):
+        try:
+            i, n = (int(x) for x in shard.split('/'))
+        except ValueError:
+            raise ValueError('shard should look like i/N, e.g. 1/4, not {!r}'.format(shard))
+    else:
+        i, n = shard
+    if not 1 <= i <= n:
+        raise ValueError('shard {}/{} out of range, i should be from 1 to N'.format(i, n))
+    return i, n
+
+
+def shard_index(key, n):
+    """Which of n shards a sequence key (a sha256 hex digest from
+    result_cache.sequence_key) belongs to, from 0.
+
+    Depends only on the sequence (and the appl, goterms and pathways
+    options), not where it is in the FASTA, so every machine agrees on
+    the split without talking to each other and identical sequences
+    always end up in the same shard, where they're only submitted once.
+    """
+    return int(key[:16], 16) % n
+
+
+def in_shard(key, shard):
+    i, n = shard
+    return shard_index(key, n) == i - 1
+
+
+def shard_dir_name(i, n):
+    return 'shard_{}_of_{}'.format(i, n)
+
+
+class WorkQueue(object):
+    """Shards of a FASTA handed out to any number of workers through
+    lock files in a directory on a shared filesystem.
+
+    A worker claims a shard by creating <queue_dir>/shard_i_of_n.lock
+    with O_EXCL, runs it into <queue_dir>/shard_i_of_n/ and then
+    writes a .done file, so workers that finish early just take more
+    shards. Use more shards than workers (e.g. 4-8 each) so the work
+    evens out. Locks are touched every stale_after/4 seconds while a
+    shard runs, a lock that hasn't been touched for stale_after seconds
+    is assumed to belong to a dead worker and can be taken over. The
+    shard directory keeps its manifest, so the new worker resumes the
+    old one's jobs by ID rather than sending them again.
+
+    Args:
+    queue_dir:
+        Directory shared by the workers, made if it doesn't exist.
+
+    shards:
+        Number of shards. Stored in the queue directory the first time,
+        later workers must use the same number.
+
+    stale_after (Default: 600):
+        Seconds without a heartbeat before a lock is taken over. Keep it
+        well above any clock difference between the machines.
+    """
+
+    def __init__(self, queue_dir, shards, stale_after = 600):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.shards = shards
+        self.stale_after = stale_after
+        # Used in file names so nothing Windows won't allow
+        self.owner = '{}_{}'.format(socket.gethostname(), os.getpid())
+        os.makedirs(self.queue_dir, exist_ok=True)
+        self._check_queue_file()
+
+    def _check_queue_file(self):
+        path = os.path.join(self.queue_dir, QUEUE_FILE_NAME)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            with open(path) as f:
+                shards = json.load(f)['shards']
+            if shards != self.shards:
+                raise ValueError('{} was made with {} shards, not {}'.format(self.queue_dir, shards, self.shards))
+            return
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'shards': self.shards}, f)
+
+    def _path(self, i, ext = ''):
+        return os.path.join(self.queue_dir, shard_dir_name(i, self.shards) + ext)
+
+    def shard_dir(self, i):
+        """Results directory of shard i, made if it doesn't exist."""
+        path = self._path(i)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def shard_dirs(self):
+        return [self._path(i) for i in range(1, self.shards+1) if os.path.isdir(self._path(i))]
+
+    def is_done(self, i):
+        return os.path.isfile(self._path(i, '.done'))
+
+    def is_finished(self):
+        return all(self.is_done(i) for i in range(1, self.shards+1))
+
+    def _try_lock(self, i):
+        lock = self._path(i, '.lock')
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._is_stale(lock) and self._take_over(i, lock):
+                return self._try_lock(i)
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.owner)
+        return True
+
+    def _is_stale(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) >= self.stale_after
+        except FileNotFoundError:
+            # Just released, try again next time round
+            return False
+
+    def _take_over(self, i, lock):
+        # Idle workers all walk the shards in the same order so tend to
+        # find a stale lock together. Only the one that makes the
+        # .takeover file gets to move it away, and it checks the lock is
+        # still stale once it has it, so a lock another worker has just
+        # taken over with is never moved. A .takeover file left by a
+        # worker that died here goes stale too.
+        takeover = lock + '.takeover'
+        try:
+            os.close(os.open(takeover, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            if self._is_stale(takeover):
+                try:
+                    os.remove(takeover)
+                except FileNotFoundError:
+                    pass
+            return False
+        try:
+            if not self._is_stale(lock):
+                return False
+            os.replace(lock, '{}.stale.{}'.format(lock, self.owner))
+        except FileNotFoundError:
+            return False
+        finally:
+            os.remove(takeover)
+        print('Taking over', shard_dir_name(i, self.shards), 'from a stale lock', file=sys.stderr)
+        return True
+
+    def claim(self):
+        """Lock the next shard that isn't done or being run by someone
+        else. Returns its number, or None if there's nothing left."""
+        for i in range(1, self.shards+1):
+            if not self.is_done(i) and self._try_lock(i):
+                # Could have been finished between the check and the lock
+                if self.is_done(i):
+                    self.release(i)
+                    continue
+                return i
+        return None
+
+    def _owns(self, i):
+        try:
+            with open(self._path(i, '.lock')) as f:
+                return f.read() == self.owner
+        except FileNotFoundError:
+            return False
+
+    def release(self, i):
+        """Give up shard i without finishing it."""
+        if self._owns(i):
+            os.remove(self._path(i, '.lock'))
+
+    def complete(self, i):
+        """Mark shard i done and drop its lock."""
+        with open(self._path(i, '.done'), 'w') as f:
+            f.write(self.owner)
+        self.release(i)
+
+    def _heartbeat(self, i, stop, lost):
+        lock = self._path(i, '.lock')
+        while not stop.wait(self.stale_after/4):
+            try:
+                if self._owns(i):
+                    os.utime(lock)
+                    continue
+            except FileNotFoundError:
+                # Taken over between the check and the touch
+                pass
+            print('Lost the lock on', shard_dir_name(i, self.shards),
+                  'to another worker', file=sys.stderr)
+            lost.set()
+            return
+
+    def run(self, func):
+        """Claim shards one after another and call func(i, n, shard_dir,
+        lost) for each until none are left. A shard is released for
+        someone else to run if func raises. If another worker takes over
+        the lock while func runs (this one looked dead) the
+        threading.Event lost is set, func should then stop as soon as it
+        can, and the shard is left for the new owner to finish and mark
+        done. Returns the shards this worker did."""
+        did = []
+        while True:
+            i = self.claim()
+            if i is None:
+                return did
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(i, stop, lost), daemon=True)
+            heartbeat.start()
+            try:
+                func(i, self.shards, self.shard_dir(i), lost)
+            except BaseException:
+                stop.set()
+                self.release(i)
+                raise
+            stop.set()
+            heartbeat.join()
+            if lost.is_set() or not self._owns(i):
+                print('Not marking', shard_dir_name(i, self.shards), 'done, another worker has it',
+                      file=sys.stderr)
+                continue
+            self.complete(i)
+            did.append(i)
+
+    def lock_merge(self):
+        """True for the one worker that gets to merge the shards."""
+        try:
+            os.close(os.open(os.path.join(self.queue_dir, MERGE_LOCK_NAME), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+
+def _read_fasta(path):
+    # [(title, seq)] of a small FASTA like iprscan_failed.faa
+    with open(path) as f:
+        text = f.read()
+    records = []
+    for chunk in text.split('>')[1:]:
+        title, _, seq = chunk.partition('\n')
+        records.append((title.strip(), ''.join(seq.split())))
+    return records
+
+
+def merge_shards(shard_dirs, out_dir, move = False):
+    """Combine the results directories of shards of a FASTA into one
+    out_dir, ready for tabulate_iprs_results.make_excel_sheet.
+
+    Results files are copied (or moved) into out_dir. They don't clash
+    as records are numbered across the whole FASTA in every shard. The
+    shards' manifests are merged into out_dir's, with paths pointing at
+    the merged files, so iprscan() can resume into out_dir, and their
+    iprscan_failed.faa files are combined.
+
+    Args:
+    shard_dirs:
+        List of shard results directories.
+
+    out_dir:
+        Where the merged results go, made if it doesn't exist.
+
+    move (Default: False):
+        Move files rather than copying them.
+
+    Returns the list of file names of records that failed.
+    """
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    transfer = shutil.move if move else shutil.copyfile
+    skip = {job_manifest.MANIFEST_FILE_NAME, job_manifest.FAILED_FASTA_NAME}
+
+    entries = {}
+    complete = set()
+    failed = []
+    n_files = 0
+    for shard_dir in shard_dirs:
+        shard_dir = os.path.abspath(shard_dir)
+        # Completeness is checked before anything is moved out of the shard
+        for key, entry in job_manifest.JobManifest(shard_dir).load().items():
+            is_complete = job_manifest.is_complete(entry)
+            if key in complete or (key in entries and not is_complete and entries[key]['time'] > entry['time']):
+                continue
+            entry = dict(entry, outputs=[os.path.join(out_dir, os.path.relpath(p, shard_dir))
+                                         for p in entry['outputs']])
+            entries[key] = entry
+            if is_complete:
+                complete.add(key)
+
+        failed_path = os.path.join(shard_dir, job_manifest.FAILED_FASTA_NAME)
+        if os.path.isfile(failed_path):
+            failed.extend(_read_fasta(failed_path))
+
+        for name in os.listdir(shard_dir):
+            path = os.path.join(shard_dir, name)
+            # Hidden files are partly written results
+            if name in skip or name.startswith('.') or not os.path.isfile(path):
+                continue
+            transfer(path, os.path.join(out_dir, name))
+            n_files += 1
+
+    job_manifest.JobManifest(out_dir).extend(entries.values())
+
+    failed_path = os.path.join(out_dir, job_manifest.FAILED_FASTA_NAME)
+    if failed:
+        with open(failed_path, 'w') as f:
+            for title, seq in failed:
+                f.write('>{}\n{}\n'.format(title, seq))
+    elif os.path.isfile(failed_path):
+        os.remove(failed_path)
+
+    print('Merged', len(shard_dirs), 'shards into', out_dir+':', n_files, 'files,',
+          len(complete), 'finished sequences,', len(failed), 'failed records.')
+    return [title for title, _ in failed]
+
+
+def run_from_command_line():
+    parser = argparse.ArgumentParser(
+        description='Merge the results directories of iprscan_from_fasta.py --shard runs into one directory.')
+    parser.add_argument('out_dir', help = 'Directory the results are merged into.')
+    parser.add_argument('shard_dirs', nargs = '*', help = 'Shard results directories.')
+    parser.add_argument('--queue', metavar = 'QUEUE_DIR', help =
+        'Merge every shard directory of a --queue work queue, instead of listing them.')
+    parser.add_argument('--move', action = 'store_true', help = 'Move the files rather than copying them.')
+    args = parser.parse_args()
+
+    shard_dirs = list(args.shard_dirs)
+    if args.queue:
+        with open(os.path.join(args.queue, QUEUE_FILE_NAME)) as f:
+            queue = WorkQueue(args.queue, json.load(f)['shards'])
+        if not queue.is_finished():
+            print('Warning: not every shard in', args.queue, 'is done', file=sys.stderr)
+        shard_dirs += queue.shard_dirs()
+    if not shard_dirs:
+        parser.error('no shard directories given')
+    merge_shards(shard_dirs, args.out_dir, move = args.move)
+
+
+if __name__ == '__main__':
+    run_from_command_line()
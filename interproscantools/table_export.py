@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+__author__ = 'https://github.com/johncthomas'
+
+import os, csv
+
+try:
+    from .tabulate_iprs_results import iter_IPRScan_xml_data, deets_to_rows
+    from .protein_record import ProteinRecord
+except ImportError:
+    from tabulate_iprs_results import iter_IPRScan_xml_data, deets_to_rows
+    from protein_record import ProteinRecord
+
+
+"""Write tabulated IPRScan results as TSV/CSV/Parquet/Feather, see write_table.__doc__"""
+
+# Same columns as make_excel_sheet
+WIDE_HEADERS = ['File Name', 'GO numbers', 'GO terms', 'Domains', 'Enzyme families', 'Sequence']
+# One value per row
+LONG_HEADERS = ['File Name', 'Field', 'Value']
+# deets keys and the name they're given in the Field column of the long layout
+LONG_FIELDS = [('go num', 'GO number'), ('go term', 'GO term'), ('dom', 'Domain'),
+               ('fam', 'Enzyme family'), ('seq', 'Sequence')]
+
+FORMATS = ('tsv', 'csv', 'parquet', 'feather')
+
+
+def long_rows(deets, add_cols_order = None):
+    """Rows of (file name, field, value) for one deets dict, one row
+    per GO number, GO term, domain etc. Also takes a ProteinRecord."""
+    if isinstance(deets, ProteinRecord):
+        deets = deets.to_deets()
+    fields = LONG_FIELDS
+    if add_cols_order:
+        fields = fields + [(k, k) for k in add_cols_order]
+    for k, field in fields:
+        v = deets[k]
+        if type(v) not in (set, list):
+            v = [v]
+        for value in v:
+            if value != '':
+                yield [deets['filen'], field, value]
+
+
+def write_table(dirname, save_filename, fmt = None, layout = 'wide',
+                overwrite = False, add_cols_order = None, deets_set = None,
+                processes = 1, batch_size = 10000, use_index = False):
+    """Write the results in a directory of IPRS xml results to a flat
+    file that's quick to write and load, with no row limit.
+
+    save_filename:
+        File to write, fmt is taken from its extension if not given.
+
+    fmt (Default: None):
+        'tsv' or 'csv' are written a row at a time. 'parquet' and
+        'feather' (Arrow IPC) are written in batches of batch_size rows
+        and need pyarrow installed. All columns are strings.
+
+    layout (Default: 'wide'):
+        'wide' gives the same rows and columns as make_excel_sheet,
+        with add_cols_order keys added as extra columns. 'long' gives
+        tidy data: File Name, Field, Value with one value per row.
+
+    deets_set, processes and use_index are as for make_excel_sheet,
+    results are parsed lazily as they're written.
+    """
+
+    dirname = os.path.abspath(dirname)
+    assert os.path.isdir(dirname)
+    if fmt is None:
+        fmt = os.path.splitext(save_filename)[1][1:].lower()
+    if fmt not in FORMATS:
+        raise ValueError('Unknown table format {}, use one of {}'.format(fmt, ', '.join(FORMATS)))
+    if layout not in ('wide', 'long'):
+        raise ValueError("layout should be 'wide' or 'long'")
+
+    save_filename = os.path.abspath(save_filename)
+    if os.path.isfile(save_filename) and not overwrite:
+        print('File', save_filename,
+              'already exists.')
+        cancel = input('Press enter to overwrite or type anything then enter to cancel.')
+        if cancel:
+            print('Cancelling...')
+            return 0
+
+    if deets_set is None:
+        deets_set = iter_IPRScan_xml_data(dirname, processes, use_index=use_index)
+
+    if layout == 'wide':
+        headers = WIDE_HEADERS + list(add_cols_order or [])
+        make_rows = deets_to_rows
+    else:
+        headers = LONG_HEADERS
+        make_rows = long_rows
+    rows = (row for deets in deets_set for row in make_rows(deets, add_cols_order))
+
+    print('saving', save_filename)
+    if fmt in ('tsv', 'csv'):
+        with open(save_filename, 'w', newline='') as f:
+            writer = csv.writer(f, delimiter='\t' if fmt == 'tsv' else ',')
+            writer.writerow(headers)
+            writer.writerows(rows)
+    else:
+        _write_arrow(rows, headers, save_filename, fmt, batch_size)
+
+
+def _write_arrow(rows, headers, save_filename, fmt, batch_size):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('pyarrow is required for Parquet and Feather output, pip install pyarrow')
+
+    schema = pa.schema([(h, pa.string()) for h in headers])
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(save_filename, schema)
+    else:
+        # Feather V2 is the Arrow IPC file format
+        writer = pa.ipc.new_file(save_filename, schema)
+
+    def write_batch(batch):
+        # rows to columns
+        columns = [pa.array([None if v is None else str(v) for v in col], pa.string())
+                   for col in zip(*batch)]
+        writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+    with writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
@@ -1,9 +1,20 @@
 import xml.sax
-import os, sys
+import os, sys, time
 import argparse
+import multiprocessing
+from copy import copy
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from  openpyxl.styles import PatternFill
 from openpyxl.styles.borders import Border, Side
+try:
+    from .metrics import registry as metrics_registry
+    from .protein_record import ProteinRecord, parse_xml_record
+    from .file_utils import is_results_file
+except ImportError:
+    from metrics import registry as metrics_registry
+    from protein_record import ProteinRecord, parse_xml_record
+    from file_utils import is_results_file
 
 
 class IprHandler_v2(xml.sax.ContentHandler):
@@ -19,14 +30,20 @@ class IprHandler_v2(xml.sax.ContentHandler):
         xml.sax.ContentHandler.__init__(self)
         self.deets = {'go num':set(), 'go term':set(), 'dom':set(), 'fam':set(),
                       'seq':''}
-        self.seq = ''
+        # Text is only collected inside <sequence>, as a list of chunks that
+        # are joined at the end tag. characters() gets called for every bit
+        # of whitespace in the document so anything else is ignored.
+        self.in_seq = False
+        self.seq_chunks = []
+
     def startElement(self, name, attrs):
 
         #create a place for the sequence, overwriting any crap that's there so far
         if name == 'sequence':
-            self.seq = ''
+            self.in_seq = True
+            self.seq_chunks = []
 
-        if name == 'entry':
+        elif name == 'entry':
             # self.interpro.add(attrs['ac'] + ' ' + attrs['desc'])
 
             if attrs['type'] == "DOMAIN":
@@ -38,7 +55,7 @@ class IprHandler_v2(xml.sax.ContentHandler):
                 # self.family.add(attrs['desc'])
                 self.deets['fam'].add(attrs['desc'])
 
-        if name == 'go-xref':
+        elif name == 'go-xref':
             # self.gonum.add(attrs['id'])
             # self.goterm.add(attrs['name'])
             self.deets['go term'].add(attrs['name'])
@@ -48,15 +65,102 @@ class IprHandler_v2(xml.sax.ContentHandler):
     def endElement(self, name):
 
         if name == 'sequence':
-            self.deets['seq'] = [self.seq]
-            #print(self.seq)
-            self.seq = ''
+            self.deets['seq'] = [''.join(self.seq_chunks)]
+            self.in_seq = False
+            self.seq_chunks = []
 
     def characters(self, content):
-        self.seq += content
-
-
-def get_IPRScan_xml_data(dirname):
+        if self.in_seq:
+            self.seq_chunks.append(content)
+
+
+def parse_xml_file(path):
+    """Parse a single IPRScan XML file. Returns a compact record tuple
+    (go nums, go terms, domains, families, seq) of tuples of strings,
+    which is cheap to pickle when parsing in other processes. Use
+    record_to_deets() to get the dict from IprHandler_v2."""
+    parser = xml.sax.make_parser()
+    handler = IprHandler_v2()
+    parser.setContentHandler(handler)
+    with open(path, 'rb') as f:
+        parser.parse(f)
+    deets = handler.deets
+    return (tuple(deets['go num']), tuple(deets['go term']),
+            tuple(deets['dom']), tuple(deets['fam']), tuple(deets['seq']))
+
+
+def _parse_named_xml_file(args):
+    # For Pool.imap, returns the file name with the record
+    dirname, xmlfile = args
+    return xmlfile, parse_xml_file(os.path.join(dirname, xmlfile))
+
+
+def _timed_parse_named_xml_file(args):
+    # As above with the time taken, which is reported by the parent process
+    t = time.perf_counter()
+    xmlfile, record = _parse_named_xml_file(args)
+    return xmlfile, record, time.perf_counter() - t
+
+
+def _timed_parse_named_xml_record(args):
+    # As above but parsing to a ProteinRecord
+    t = time.perf_counter()
+    dirname, xmlfile = args
+    record = parse_xml_record(os.path.join(dirname, xmlfile), xmlfile)
+    return xmlfile, record, time.perf_counter() - t
+
+
+def record_to_deets(xmlfile, record):
+    """Dict in the format returned by get_IPRScan_xml_data from a
+    parse_xml_file() record."""
+    go_num, go_term, dom, fam, seq = record
+    return {'go num':set(go_num), 'go term':set(go_term), 'dom':set(dom),
+            'fam':set(fam), 'seq':list(seq) if seq else '', 'filen':xmlfile}
+
+
+def iter_IPRScan_xml_data(dirname, processes = 1, chunksize = 32, ordered = True,
+                          use_index = False, records = False):
+    """Generator version of get_IPRScan_xml_data, yields the dict for
+    each file as it's parsed so the whole directory is never held in
+    memory. Same arguments as get_IPRScan_xml_data. The time taken to
+    parse each file is reported to metrics.registry as parse.file."""
+
+    if use_index and records:
+        raise ValueError("use_index can't be used with records, the index only keeps the deets")
+    if use_index:
+        try:
+            from .result_index import ResultIndex
+        except ImportError:
+            from result_index import ResultIndex
+        with ResultIndex(dirname) as index:
+            parsed, removed = index.update(processes, chunksize)
+            print('Index updated,', parsed, 'files parsed,', removed, 'removed.')
+            yield from index.iter_deets()
+        return
+
+    xml_files = (entry.name for entry in os.scandir(dirname)
+                 if is_results_file(entry.name))
+
+    tasks = ((dirname, xmlfile) for xmlfile in xml_files)
+    parse = _timed_parse_named_xml_record if records else _timed_parse_named_xml_file
+    if processes == 1:
+        parsed = map(parse, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        imap = pool.imap if ordered else pool.imap_unordered
+        parsed = imap(parse, tasks, chunksize)
+    try:
+        for xmlfile, record, secs in parsed:
+            metrics_registry.observe('parse.file', secs, file=xmlfile)
+            yield record if records else record_to_deets(xmlfile, record)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def get_IPRScan_xml_data(dirname, processes = 1, chunksize = 32, ordered = True,
+                         use_index = False, records = False):
     # Adapted from http://michaelrthon.com/runiprscan/
     """returns a list of dicts containing filename and
     details specified in IprHandler_v2
@@ -66,27 +170,59 @@ def get_IPRScan_xml_data(dirname):
         'dom' - any domains
         'fam' - family membership of the protein
         'go num' & 'go term' - Gene Ontology numbers and terms.
-    'filen' will be a string, the rest are set()"""
-
-    all_deets = []
-
-    file_list = os.listdir(dirname)
-
-    for xmlfile in file_list:
-        if not xmlfile.endswith('xml'):
-            continue
-
-        parser = xml.sax.make_parser()
-        handler = IprHandler_v2()
-        parser.setContentHandler(handler)
-        parser.parse(open(dirname+'/'+xmlfile))
-        #pdb.set_trace()
-        deets = handler.deets
-        deets['filen'] = xmlfile
-        all_deets.append(deets)
-        #return
-
-    return all_deets
+    'filen' will be a string, the rest are set()
+
+    Files can be parsed in parallel by passing processes > 1 (None
+    to use every CPU). They're sent to the worker processes chunksize
+    files at a time. With ordered=False results are collected as
+    soon as they're ready, in no particular order.
+
+    With use_index the records are kept in a ResultIndex in dirname
+    so only new or changed files are parsed, ordered by file name.
+
+    With records=True you get a protein_record.ProteinRecord for each
+    file instead of a dict, which also has the InterPro accessions and
+    match positions, scores and databases, in less memory. Use
+    ProteinRecord.to_deets() for the dict, make_excel_sheet and
+    table_export take either. Can't be used with use_index.
+
+    See iter_IPRScan_xml_data for a generator version."""
+
+    return list(iter_IPRScan_xml_data(dirname, processes, chunksize, ordered, use_index, records))
+
+
+def deets_to_rows(deets, add_cols_order = None):
+    """Rows of the results table for one deets dict. The first column
+    is the file name, then one GO number, GO term, domain, family and
+    sequence per row (plus add_cols_order keys) until all are listed.
+    A ProteinRecord is turned into its deets dict first."""
+    if isinstance(deets, ProteinRecord):
+        deets = deets.to_deets()
+    deets_keys = ['go num', 'go term', 'dom', 'fam', 'seq']
+
+    if add_cols_order:
+        deets_keys+=add_cols_order
+    # put single items into lists, convert sets
+    fields = []
+    for k in deets_keys:
+        v = deets[k]
+        if type(v) is set:
+            v = list(v)
+        elif type(v) is not list:
+            v = [v]
+        fields.append(v)
+
+    # Get the longest list length
+    depth = sorted([len(x) for x in fields])[-1]
+
+    for i in range(depth):
+        row = [deets['filen']]
+        for field in fields:
+            try:
+                row.append(field[i])
+            except IndexError:
+                row.append('')
+        yield row
 
 
 def make_excel_sheet(dirname,
@@ -95,20 +231,30 @@ def make_excel_sheet(dirname,
                      overwrite = False,
                      additional_cols = None,
                      add_cols_order = None,
-                     deets_set = None):
+                     deets_set = None,
+                     processes = 1,
+                     use_index = False):
     """Make an openpyxl.Workbook() containing details of results of
     a directory of IPRS xml results. The dir can contain non-xml
     files. Pass a save_filename and an Excel file will be created.
     Pass an openpyxl worksheet and the updated sheet will be returned.
     Pass neither and a freshly created Workbook will be returned.
-    
+    When saving to a file a write-only Workbook is used, rows are
+    styled as they're written and streamed out to disk rather than
+    the whole sheet being held in memory.
+
     addictional_cols should be a dict with column headers as keys, and
     values either being a list of row values that should be ordered to
     match the IPRS results XML, or a dict with keys that match IPRS XML
     file names. add_cols_order is an optional list of key values in the
     order you want them on the final Excel sheet.
 
-    Use deets_set if you're running get_IPRScan_xml_data seperately.
+    Use deets_set if you're running get_IPRScan_xml_data seperately, any
+    iterable of deets dicts or ProteinRecords works, e.g. from
+    iter_IPRScan_xml_data. By
+    default files are parsed one at a time as rows are written.
+    processes is passed to iter_IPRScan_xml_data to parse files in parallel,
+    and use_index to only parse files that are new since the last run.
      """
 
 
@@ -130,11 +276,14 @@ def make_excel_sheet(dirname,
                 return 0
 
 
-    if sheet is None:
-        wb = openpyxl.Workbook()
-        active_sheet = wb.get_active_sheet()
-    else:
+    if sheet is not None:
         active_sheet = sheet
+    elif save_filename:
+        wb = openpyxl.Workbook(write_only=True)
+        active_sheet = wb.create_sheet()
+    else:
+        wb = openpyxl.Workbook()
+        active_sheet = wb.active
 
     # Define colours, using a bunch so that there's less chance reordering the sheet makes it confusing
     # Got these RGBA from matplotlib.cm 'Pastel1' colour map
@@ -179,6 +328,24 @@ def make_excel_sheet(dirname,
     row_colr = int_to_hex((100, 100, 100))
     row_border = Border(bottom=Side(style='thin', color=row_colr))
 
+    # Cells are styled as they're created. The fill/border combination for
+    # each colour is registered with the workbook once and copied to every
+    # cell, which is much faster than setting cell.fill & cell.border.
+    row_styles = []
+    for colr in colrs:
+        template = WriteOnlyCell(active_sheet)
+        template.fill = colr
+        template.border = row_border
+        row_styles.append(template._style)
+
+    def append_row(values, style):
+        row = []
+        for v in values:
+            cell = WriteOnlyCell(active_sheet, v)
+            cell._style = copy(style)
+            row.append(cell)
+        active_sheet.append(row)
+
     # Headers
     headers = ['File Name', 'GO numbers', 'GO terms', 'Domains', 'Enzyme families', 'Sequence']
     if additional_cols or add_cols_order:
@@ -187,52 +354,21 @@ def make_excel_sheet(dirname,
         else:
             add_cols_order = list(additional_cols.keys())
             headers = headers+add_cols_order
-    active_sheet.append(headers)
+    append_row(headers, row_styles[0])
+    rowi = 1
 
     # Add results
     if deets_set is None:
-        deets_set = get_IPRScan_xml_data(dirname)
-
-    for result_i, deets in enumerate( deets_set ):
-        deets_keys = ['go num', 'go term', 'dom', 'fam', 'seq']
+        deets_set = iter_IPRScan_xml_data(dirname, processes, use_index=use_index)
 
-        if add_cols_order:
-            deets_keys+=add_cols_order
-        # put single items into lists, convert sets
-        fields = []
-        for k in deets_keys:
-            v = deets[k]
-            if type(v) is set:
-                v = list(v)
-            elif type(v) is not list:
-                v = [v]
-            fields.append(v)
-
-        # Get the longest list length
-        depth = sorted([len(x) for x in fields])[-1]
-
-        for i in range(depth):
-            row = [deets['filen']]
-            for field in fields:
-                try:
-                    row.append(field[i])
-                except IndexError:
-                    row.append('')
-            #print(row)
-            active_sheet.append(row)
-
-    # Do colours. Each sequence's results occupies some rows, we want all rows
+    # Each sequence's results occupies some rows, we want all rows
     # associated with a sequence to be the same colour
-    prev_prot = None
-    for rowi, row in enumerate(active_sheet.rows):
-        # Check if this row is for a new result set
-        if row[0].value != prev_prot:
-            prev_prot = row[0].value
-            # cycle through colors
-            current_colour = colrs[rowi%len(colrs)]
-        for cell in row:
-            cell.fill = current_colour
-            cell.border = row_border
+    for deets in deets_set:
+        # cycle through colors, picked by the row the result starts on
+        style = row_styles[rowi%len(row_styles)]
+        for row in deets_to_rows(deets, add_cols_order):
+            append_row(row, style)
+            rowi += 1
 
     # book.save(paff+'GO terms 18Feb.xlsx')
 
@@ -251,12 +387,36 @@ def run_from_command_line():
         and associated Gene Ontology terms from a directory of InterProScan XML files.""",
     )
     parser.add_argument("dir_name", help = 'Directory holding the IPRScan XML results files.')
-    parser.add_argument('excel_file', help = 'Name and path of Excel that will be created.')
+    parser.add_argument('excel_file', help = 'Name and path of Excel that will be created. '
+                        'Use a .tsv, .csv, .parquet or .feather extension to write that format instead.')
     parser.add_argument('-o', '--overwrite', action = 'store_true', default = False,
                         help = 'If the specified Excel file already exists, overwrite it without warning.')
+    parser.add_argument('-j', '--processes', type = int, default = 1,
+                        help = 'Parse XML files in this many processes at once. 0 to use all CPUs.')
+    parser.add_argument('-i', '--index', action = 'store_true',
+                        help = 'Keep parsed results in an index file in DIR_NAME, so '
+                               'only new or changed XML files are parsed on later runs.')
+    parser.add_argument('-l', '--long', action = 'store_true',
+                        help = 'Write one value per row (File Name, Field, Value). Not for Excel files.')
+    parser.add_argument('--metrics', metavar = 'FILE',
+                        help = 'Append the parse time of every file to this JSON-lines file.')
     args = parser.parse_args()
+    if args.metrics:
+        metrics_registry.open_file(args.metrics)
     #print(args.overwrite)
-    make_excel_sheet(args.dir_name, args.excel_file, overwrite = args.overwrite)
+    ext = os.path.splitext(args.excel_file)[1][1:].lower()
+    if ext in ('tsv', 'csv', 'parquet', 'feather'):
+        try:
+            from .table_export import write_table
+        except ImportError:
+            from table_export import write_table
+        write_table(args.dir_name, args.excel_file, layout = 'long' if args.long else 'wide',
+                    overwrite = args.overwrite, processes = args.processes or None,
+                    use_index = args.index)
+    else:
+        make_excel_sheet(args.dir_name, args.excel_file, overwrite = args.overwrite,
+                         processes = args.processes or None, use_index = args.index)
+    metrics_registry.close()
 
 if __name__ == '__main__':
     # paff = r'C:\Users\JT\Dropbox\PhD\Experiments\Bioinfo\strain C comparison/'.replace('\\', '/')
@@ -8,8 +8,9 @@ setup(
     author='John C. Thomas',
     author_email='jaytee00@gmail.com',
     include_package_data=True,
-    install_requires = ['biopython >= 1.43','openpyxl >= 2',],
+    install_requires = ['openpyxl >= 2',],
     #extras_require = {'Excel':'openpyxl >= 2'},
+    extras_require = {'arrow':['pyarrow']},
     classifiers= ['Programming Language :: Python :: 3',
                   'Development Status :: 4 - beta',],
     keywords = "interpro interproscan interproscan_tools bioinformatics protein biopython",
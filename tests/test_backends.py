@@ -0,0 +1,111 @@
+"""LocalBackend run through iprscan() with benchmarks/interproscan_stub.py
+standing in for interproscan.sh.
+
+    python -m pytest tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+from unittest import mock
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+from interproscantools.iprscan_from_fasta import iprscan
+from interproscantools.backends import LocalBackend
+from interproscantools.job_scheduler import Job
+from interproscantools.result_cache import sequence_key
+from interproscantools.result_xml import split_xml_file
+from interproscantools.tabulate_iprs_results import get_IPRScan_xml_data
+from interproscantools import job_manifest
+
+STUB = os.path.join(REPO_DIR, 'benchmarks', 'interproscan_stub.py')
+
+SEQS = ['MKVLAAGIVGLLLAQ', 'MSTNPKPQRKTKRNT', 'MAHHHHHHVDDDDKM',
+        'MGSSHHHHHHSSGLV', 'MKKLLPTAAAGLLLL']
+
+
+class LocalBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.out_dir = os.path.join(self.tmp, 'out')
+        os.mkdir(self.out_dir)
+        self.fasta = os.path.join(self.tmp, 'in.faa')
+        with open(self.fasta, 'w') as f:
+            for i, seq in enumerate(SEQS):
+                f.write('>protein_{}\n{}\n'.format(i, seq))
+        # Quiet iprscan()'s progress output
+        devnull = open(os.devnull, 'w')
+        self.addCleanup(devnull.close)
+        for stream in ('stdout', 'stderr'):
+            patcher = mock.patch.object(sys, stream, devnull)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_iprscan(self, **backend_args):
+        backend = LocalBackend(STUB, **dict({'batch_size': 2, 'processes': 2}, **backend_args))
+        return iprscan(self.fasta, self.out_dir, 'test@example.com', backend=backend)
+
+    def manifest_states(self):
+        return {entry['file_names'][0]: entry['state']
+                for entry in job_manifest.JobManifest(self.out_dir).load().values()}
+
+    def test_batches_split_into_protein_files(self):
+        failed = self.run_iprscan()
+        self.assertEqual(failed, [])
+        for i, seq in enumerate(SEQS):
+            path = os.path.join(self.out_dir, '{}.xml.xml'.format(i))
+            proteins = split_xml_file(path)
+            # One protein per file, the right one
+            self.assertEqual(len(proteins), 1)
+            self.assertEqual(proteins[0][1], [sequence_key(seq)])
+        self.assertEqual(set(self.manifest_states().values()), {job_manifest.FINISHED})
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, job_manifest.FAILED_FASTA_NAME)))
+
+    def test_failed_run_reported(self):
+        with mock.patch.dict(os.environ, {'IPRSTUB_FAIL_RATE': '1'}):
+            failed = self.run_iprscan()
+        self.assertEqual(sorted(failed), [str(i) for i in range(len(SEQS))])
+        self.assertEqual(set(self.manifest_states().values()), {job_manifest.FAILED})
+        with open(os.path.join(self.out_dir, job_manifest.FAILED_FASTA_NAME)) as f:
+            self.assertEqual(f.read().count('>'), len(SEQS))
+
+    def test_failed_run_calls_on_failed(self):
+        jobs = [Job(sequence_key(seq), seq, [str(i)], os.path.join(self.out_dir, str(i)))
+                for i, seq in enumerate(SEQS)]
+        finished, failed = [], []
+        with mock.patch.dict(os.environ, {'IPRSTUB_FAIL_RATE': '1'}):
+            LocalBackend(STUB, batch_size=2).run(
+                jobs, {}, on_finished=lambda job, written: finished.append(job),
+                on_failed=lambda job, ex: failed.append((job, ex)))
+        self.assertEqual(finished, [])
+        self.assertEqual(sorted(job.key for job, _ in failed), sorted(job.key for job in jobs))
+        self.assertIn('exit status', str(failed[0][1]))
+
+    def test_sequence_missing_from_output(self):
+        with mock.patch.dict(os.environ, {'IPRSTUB_DROP': SEQS[1]}):
+            failed = self.run_iprscan()
+        self.assertEqual(failed, ['1'])
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, '1.xml.xml')))
+        # The rest of its batch is still written
+        self.assertTrue(os.path.exists(os.path.join(self.out_dir, '0.xml.xml')))
+        states = self.manifest_states()
+        self.assertEqual(states.pop('1'), job_manifest.FAILED)
+        self.assertEqual(set(states.values()), {job_manifest.FINISHED})
+
+    def test_leftover_batch_file_not_tabulated(self):
+        self.run_iprscan()
+        # As left by a crash between downloading a batch and splitting it
+        with open(os.path.join(self.out_dir, '.batch_0.xml.xml'), 'wb') as out:
+            for i in range(2):
+                with open(os.path.join(self.out_dir, '{}.xml.xml'.format(i)), 'rb') as f:
+                    out.write(f.read())
+        deets = get_IPRScan_xml_data(self.out_dir)
+        self.assertEqual(sorted(d['filen'] for d in deets),
+                         ['{}.xml.xml'.format(i) for i in range(len(SEQS))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""JobManifest recovering from a crash part way through a line.
+
+    python -m pytest tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+from interproscantools import job_manifest
+from interproscantools.job_manifest import JobManifest
+
+
+class JobManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_record_after_torn_line(self):
+        manifest = JobManifest(self.tmp)
+        manifest.record('a', job_manifest.SUBMITTED, 'job-a', ['0'])
+        with open(manifest.path, 'a') as f:
+            f.write('{"key": "b", "sta')
+        # As after a restart
+        manifest = JobManifest(self.tmp)
+        manifest.record('c', job_manifest.SUBMITTED, 'job-c', ['2'])
+        manifest.record('a', job_manifest.FINISHED, 'job-a', ['0'])
+        entries = manifest.load()
+        self.assertEqual(sorted(entries), ['a', 'c'])
+        self.assertEqual(entries['a']['state'], job_manifest.FINISHED)
+
+    def test_new_manifest(self):
+        manifest = JobManifest(self.tmp)
+        manifest.extend([{'key': 'a', 'state': job_manifest.FAILED}])
+        with open(manifest.path) as f:
+            self.assertEqual(f.read().count('\n'), 1)
+        self.assertEqual(list(manifest.load()), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""JobScheduler run through iprscan() against the mock EBI server.
+
+    python -m pytest tests
+"""
+
+import os, sys, shutil, tempfile, threading, unittest
+from unittest import mock
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+from interproscantools.iprscan_from_fasta import iprscan
+from interproscantools.mock_server import MockIPRScanServer
+from interproscantools import job_manifest, iprscan_from_fasta, IPRScan
+
+SEQS = ['MKVLAAGIVGLLLAQ', 'MSTNPKPQRKTKRNT', 'MAHHHHHHVDDDDKM']
+
+
+class JobSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.out_dir = os.path.join(self.tmp, 'out')
+        os.mkdir(self.out_dir)
+        self.fasta = os.path.join(self.tmp, 'in.faa')
+        with open(self.fasta, 'w') as f:
+            for i, seq in enumerate(SEQS):
+                f.write('>protein_{}\n{}\n'.format(i, seq))
+        self.server = MockIPRScanServer(job_duration=0.05, seed=1)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        # Quiet iprscan()'s progress output
+        devnull = open(os.devnull, 'w')
+        self.addCleanup(devnull.close)
+        for stream in ('stdout', 'stderr'):
+            patcher = mock.patch.object(sys, stream, devnull)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_iprscan(self, **kwargs):
+        return iprscan(self.fasta, self.out_dir, 'test@example.com', base_url=self.server.url,
+                       polling_time=0.05, results_formats=['xml'], **kwargs)
+
+    def manifest_states(self):
+        return {entry['file_names'][0]: entry['state']
+                for entry in job_manifest.JobManifest(self.out_dir).load().values()}
+
+    def test_finishes(self):
+        self.assertEqual(self.run_iprscan(), [])
+        self.assertEqual(set(self.manifest_states().values()), {job_manifest.FINISHED})
+
+    def test_error_in_on_finished_fails_the_job(self):
+        with mock.patch.object(iprscan_from_fasta, 'copy_results', side_effect=OSError('disk full')):
+            failed = self.run_iprscan()
+        self.assertEqual(sorted(failed), [str(i) for i in range(len(SEQS))])
+        self.assertEqual(set(self.manifest_states().values()), {job_manifest.FAILED})
+
+    def test_precalc_service_down(self):
+        # Nothing listens on port 1, the sequences are scanned instead
+        with mock.patch.object(IPRScan, 'maxRetries', 0):
+            failed = self.run_iprscan(precalc='http://127.0.0.1:1/precalc')
+        self.assertEqual(failed, [])
+        self.assertEqual(set(self.manifest_states().values()), {job_manifest.FINISHED})
+
+    def test_stop(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(self.run_iprscan(stop_event=stop), [])
+        self.assertEqual(self.manifest_states(), {})
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, job_manifest.FAILED_FASTA_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
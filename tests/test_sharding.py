@@ -0,0 +1,73 @@
+"""WorkQueue lock takeover between workers sharing a queue directory.
+
+    python -m pytest tests
+"""
+
+import os, sys, time, shutil, tempfile, unittest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+from interproscantools.sharding import WorkQueue
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.queue = WorkQueue(self.tmp, 1, stale_after=60)
+        self.lock = self.queue._path(1, '.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def write_lock(self, owner, age = 0):
+        with open(self.lock, 'w') as f:
+            f.write(owner)
+        t = time.time() - age
+        os.utime(self.lock, (t, t))
+
+    def lock_owner(self):
+        with open(self.lock) as f:
+            return f.read()
+
+    def test_stale_lock_taken_over(self):
+        self.write_lock('dead_1', age=120)
+        self.assertEqual(self.queue.claim(), 1)
+        self.assertEqual(self.lock_owner(), self.queue.owner)
+
+    def test_fresh_lock_kept(self):
+        self.write_lock('alive_1')
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.lock_owner(), 'alive_1')
+
+    def test_lock_replaced_after_stale_check(self):
+        # Another worker took the stale lock over between this one
+        # seeing it was stale and moving it away
+        self.write_lock('other_1')
+        self.assertFalse(self.queue._take_over(1, self.lock))
+        self.assertEqual(self.lock_owner(), 'other_1')
+        self.assertFalse(os.path.exists(self.lock + '.takeover'))
+
+    def test_takeover_in_progress(self):
+        self.write_lock('dead_1', age=120)
+        open(self.lock + '.takeover', 'w').close()
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.lock_owner(), 'dead_1')
+
+    def test_lost_lock_stops_shard(self):
+        queue = WorkQueue(self.tmp, 1, stale_after=0.2)
+        seen = []
+
+        def func(i, n, shard_dir, lost):
+            # Another worker takes the shard over while it runs
+            self.write_lock('other_1')
+            seen.append(lost.wait(5))
+
+        self.assertEqual(queue.run(func), [])
+        self.assertEqual(seen, [True])
+        self.assertFalse(queue.is_done(1))
+        self.assertEqual(self.lock_owner(), 'other_1')
+
+
+if __name__ == '__main__':
+    unittest.main()